@@ -1,39 +1,107 @@
 import arxiv
-import time
-from typing import List, Dict
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List, Dict, Iterator, Optional
 from config import PAPERS_PER_REQUEST, WAIT_TIME, SEARCH_QUERY
 import loguru
+from metrics import ARXIV_PAGES_FETCHED, ARXIV_PAPERS_FETCHED
+from utils import parse_arxiv_id, content_hash
 
 logger = loguru.logger
 
 
 
 class ArxivCollector:
-    def __init__(self,query: str="Deep learning") -> None:
-        self.client = arxiv.Client()
+    def __init__(self,
+                 query: str="Deep learning",
+                 page_size: int = PAPERS_PER_REQUEST,
+                 delay_seconds: float = WAIT_TIME,
+                 api_url: Optional[str] = None) -> None:
+        # arxiv.Client fetches results page by page and waits delay_seconds
+        # between API pages, so no extra sleeping is needed per record
+        self.client = arxiv.Client(page_size=page_size, delay_seconds=delay_seconds)
+        if api_url is not None:
+            # e.g. a local stand-in for the API, see benchmark.py
+            self.client.query_url_format = f"{api_url}?{{}}"
+        self.page_size = page_size
         self.query = query
 
-    def collect_papers(self, max_results: int = 10) -> List[Dict]:
+    def iter_papers(self, max_results: int = 10, since: Optional[datetime] = None,
+                    is_stored: Optional[Callable[[str], bool]] = None) -> Iterator[Dict]:
+        """
+        Yields parsed papers as soon as each API page arrives.
+
+        If since (naive UTC) is given, only papers updated from it on are
+        yielded, oldest first, so a capped run never leaves a gap behind the
+        watermark. A capped run may stop between papers sharing a timestamp,
+        so those updated exactly at since are kept unless is_stored(id).
+        max_results then counts yielded papers, not fetched ones.
+        """
         logger.info(f"Collecting papers using query: {self.query}")
-        search = arxiv.Search(
-            query=self.query,
-            max_results=max_results,
-            sort_by=arxiv.SortCriterion.SubmittedDate
-        )
-
-        papers = []
-        for result in self.client.results(search):
+        if since is None:
+            search = arxiv.Search(
+                query=self.query,
+                max_results=max_results,
+                sort_by=arxiv.SortCriterion.SubmittedDate
+            )
+        else:
+            logger.info(f"Fetching papers updated since {since.isoformat()}")
+            search = arxiv.Search(
+                query=self._delta_query(since),
+                max_results=None,
+                sort_by=arxiv.SortCriterion.LastUpdatedDate,
+                sort_order=arxiv.SortOrder.Ascending
+            )
+
+        yielded = 0
+        for index, result in enumerate(self.client.results(search)):
+            # results arrive a page at a time, the first result of a page marks its arrival
+            if index % self.page_size == 0:
+                ARXIV_PAGES_FETCHED.inc()
+            ARXIV_PAPERS_FETCHED.inc()
+            paper = self._result_to_dict(result)
+            if since is not None and self._behind_watermark(paper, since, is_stored):
+                continue
             logger.debug(f"Found paper: {result.title}")
-            paper = {
-                'id': result.entry_id,
-                'title': result.title,
-                'abstract': result.summary,
-                'authors': [author.name for author in result.authors],
-                'published': result.published.strftime('%Y-%m-%d'),
-                'updated': result.updated.strftime('%Y-%m-%d'),
-                'categories': result.categories
-            }
-            papers.append(paper)
-            time.sleep(WAIT_TIME)
-
-        return papers
+            yield paper
+            yielded += 1
+            if max_results is not None and yielded >= max_results:
+                return
+
+    def collect_papers(self, max_results: int = 10, since: Optional[datetime] = None,
+                       is_stored: Optional[Callable[[str], bool]] = None) -> List[Dict]:
+        return list(self.iter_papers(max_results=max_results, since=since, is_stored=is_stored))
+
+    @staticmethod
+    def _behind_watermark(paper: Dict, since: datetime, is_stored: Optional[Callable[[str], bool]]) -> bool:
+        # the API range is minute-grained, so older papers of that minute come back too
+        updated = datetime.fromisoformat(paper['updated_at'])
+        if updated < since:
+            return True
+        return updated == since and (is_stored is None or is_stored(paper['id']))
+
+    def _delta_query(self, since: datetime) -> str:
+        until = datetime.now(timezone.utc) + timedelta(days=1)
+        return f"({self.query}) AND lastUpdatedDate:[{since:%Y%m%d%H%M} TO {until:%Y%m%d%H%M}]"
+
+    @staticmethod
+    def _to_naive_utc(value: datetime) -> datetime:
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
+    @staticmethod
+    def _result_to_dict(result: arxiv.Result) -> Dict:
+        # Papers are keyed by the unversioned id, so a new version replaces the old one
+        paper_id, version = parse_arxiv_id(result.entry_id)
+        return {
+            'id': paper_id,
+            'version': version,
+            'content_hash': content_hash(result.title, result.summary),
+            'title': result.title,
+            'abstract': result.summary,
+            'authors': [author.name for author in result.authors],
+            'published': result.published.strftime('%Y-%m-%d'),
+            'updated': result.updated.strftime('%Y-%m-%d'),
+            'updated_at': ArxivCollector._to_naive_utc(result.updated).isoformat(),
+            'categories': result.categories
+        }
@@ -0,0 +1,520 @@
+"""
+Offline benchmark of the pipeline stages.
+
+Runs ArxivCollector, LLMProcessor and Database.save_papers against local
+stand-ins for the arXiv API and Ollama on synthetic papers, and reports
+papers/sec, p50/p95/p99 latency and peak RSS per stage and end to end:
+
+    python benchmark.py --sizes 1000 10000 100000 --llm-latency 0.02
+
+Both stand-ins listen on 127.0.0.1, every run writes to a temporary
+database and the LLM response cache is off, so runs are repeatable and
+leave the project's files alone. Logging is reduced to warnings so that
+log I/O does not dominate the numbers.
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import re
+import resource
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional
+from urllib.parse import parse_qs, urlparse
+from xml.sax.saxutils import escape, quoteattr
+
+import loguru
+
+from arxiv_scrap import ArxivCollector
+from preproc import LLMProcessor, COMPLEXITY_LEVELS, PROMPT_VERSION
+from database import Database
+from pipeline import Skipped, stream_and_save
+from config import LLM_MAX_CONCURRENCY, LLM_PACK_SIZE, PAPERS_PER_REQUEST, DB_BATCH_SIZE, DB_FLUSH_SIZE
+from utils import logger, content_hash
+
+BENCH_MODEL = "ollama/benchmark"
+STAGES = ("collect", "llm", "save", "e2e")
+
+# Synthetic data
+
+_WORDS = (
+    "learning", "neural", "network", "model", "data", "training", "graph", "attention",
+    "transformer", "optimization", "gradient", "representation", "inference", "sparse",
+    "robust", "efficient", "scalable", "benchmark", "dataset", "language", "vision",
+    "reinforcement", "policy", "generative", "diffusion", "latent", "embedding", "retrieval",
+    "federated", "privacy", "causal", "bayesian", "kernel", "convex", "stochastic", "pipeline",
+    "query", "database", "index", "stream", "we", "propose", "show", "that", "the", "a", "of",
+    "for", "with", "on", "and", "results", "method", "approach", "performance", "state-of-the-art",
+)
+_FIRST_NAMES = ("Alice", "Bob", "Chen", "Dmitry", "Elena", "Farid", "Grace", "Hiro", "Ines", "Jonas",
+                "Kemal", "Lena", "Mateo", "Nadia", "Oleg", "Priya", "Quentin", "Rosa", "Sven", "Tara")
+_LAST_NAMES = ("Smith", "Wang", "Ivanov", "Garcia", "Kim", "Muller", "Rossi", "Sato", "Novak", "Silva",
+               "Nguyen", "Petrov", "Cohen", "Okafor", "Larsen", "Kowalski", "Haddad", "Moreau", "Singh", "Berg")
+_CATEGORIES = ("cs.LG", "cs.AI", "cs.CL", "cs.CV", "cs.DB", "cs.IR", "stat.ML", "math.OC")
+_BASE_DATE = datetime(2024, 1, 1)
+
+
+def synthetic_paper(index: int, seed: int = 0) -> Dict:
+    """Deterministic paper shaped like ArxivCollector output"""
+    rng = random.Random(seed * 1_000_003 + index)
+    published = _BASE_DATE + timedelta(minutes=index)
+    updated = published + timedelta(hours=rng.randint(0, 720))
+    title = " ".join(rng.choices(_WORDS, k=rng.randint(6, 12))).capitalize()
+    abstract = " ".join(rng.choices(_WORDS, k=rng.randint(120, 220))).capitalize() + "."
+    return {
+        'id': f"{2401 + index // 100000}.{index % 100000:05d}",
+        'version': 1,
+        'content_hash': content_hash(title, abstract),
+        'title': title,
+        'abstract': abstract,
+        'authors': [f"{rng.choice(_FIRST_NAMES)} {rng.choice(_LAST_NAMES)} {rng.randint(1, 50)}"
+                    for _ in range(rng.randint(1, 6))],
+        'published': published.strftime('%Y-%m-%d'),
+        'updated': updated.strftime('%Y-%m-%d'),
+        'updated_at': updated.isoformat(),
+        'categories': rng.sample(_CATEGORIES, rng.randint(1, 3))
+    }
+
+
+def synthetic_papers(count: int, seed: int = 0) -> Iterator[Dict]:
+    for index in range(count):
+        yield synthetic_paper(index, seed)
+
+
+def synthetic_analysis(rng: random.Random) -> Dict:
+    return {
+        'main_topic': " ".join(rng.choices(_WORDS, k=8)),
+        'key_findings': [" ".join(rng.choices(_WORDS, k=6)) for _ in range(rng.randint(2, 3))],
+        'complexity': rng.choice(COMPLEXITY_LEVELS)
+    }
+
+
+def _with_analysis(paper: Dict) -> Dict:
+    analysis = synthetic_analysis(random.Random(paper['id']))
+    paper.update(analysis, llm_analysis=json.dumps(analysis), status='analyzed',
+                 llm_model=BENCH_MODEL, prompt_version=PROMPT_VERSION)
+    return paper
+
+
+# Local stand-ins for the arXiv API and Ollama
+
+class StandInServer(ThreadingHTTPServer):
+    """HTTP server on a free local port, serving from a daemon thread"""
+
+    daemon_threads = True
+
+    def __init__(self, handler, **settings):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.settings = settings
+        threading.Thread(target=self.serve_forever, name=handler.__name__, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    # Keep-alive, like the real services; without TCP_NODELAY the separate
+    # header and body writes stall on delayed ACKs (~40 ms per response)
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def _send(self, body: bytes, content_type: str, status: int = 200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeArxivHandler(_StandInHandler):
+    """
+    Serves GET /api/query as an Atom feed of synthetic papers, paged with
+    start and max_results. settings: total (papers available), seed.
+    """
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != "/api/query":
+            self._send(b"not found", "text/plain", 404)
+            return
+        args = parse_qs(url.query)
+        total = self.server.settings['total']
+        start = int(args.get('start', ['0'])[0])
+        stop = min(total, start + int(args.get('max_results', ['10'])[0]))
+        entries = "".join(
+            self._entry(synthetic_paper(index, self.server.settings['seed']))
+            for index in range(start, stop)
+        )
+        feed = (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<feed xmlns="http://www.w3.org/2005/Atom" '
+            'xmlns:opensearch="http://a9.com/-/spec/opensearch/1.1/" '
+            'xmlns:arxiv="http://arxiv.org/schemas/atom">'
+            '<title>ArXiv Query</title>'
+            f'<opensearch:totalResults>{total}</opensearch:totalResults>'
+            f'<opensearch:startIndex>{start}</opensearch:startIndex>'
+            f'<opensearch:itemsPerPage>{stop - start}</opensearch:itemsPerPage>'
+            f'{entries}</feed>'
+        )
+        self._send(feed.encode("utf-8"), "application/atom+xml")
+
+    @staticmethod
+    def _entry(paper: Dict) -> str:
+        entry_id = f"http://arxiv.org/abs/{paper['id']}v{paper['version']}"
+        authors = "".join(f"<author><name>{escape(name)}</name></author>" for name in paper['authors'])
+        categories = "".join(f"<category term={quoteattr(term)}/>" for term in paper['categories'])
+        return (
+            f"<entry><id>{entry_id}</id>"
+            f"<updated>{paper['updated_at']}Z</updated>"
+            f"<published>{paper['published']}T00:00:00Z</published>"
+            f"<title>{escape(paper['title'])}</title>"
+            f"<summary>{escape(paper['abstract'])}</summary>"
+            f"{authors}"
+            f"<link href={quoteattr(entry_id)} rel=\"alternate\" type=\"text/html\"/>"
+            f"<arxiv:primary_category term={quoteattr(paper['categories'][0])}/>"
+            f"{categories}</entry>"
+        )
+
+
+# Identifiers listed in LLMProcessor._build_pack_prompt
+_PACK_IDS = re.compile(r"one key per paper identifier \(([^)]*)\)")
+
+
+class FakeOllamaHandler(_StandInHandler):
+    """
+    Answers POST /api/generate like Ollama with a valid JSON analysis (one
+    per identifier for packed prompts). A response takes settings['latency']
+    seconds plus its token count divided by settings['tokens_per_second'].
+    """
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if self.path != "/api/generate":
+            self._send(b"not found", "text/plain", 404)
+            return
+
+        rng = random.Random(payload['prompt'])
+        pack = _PACK_IDS.search(payload['prompt'])
+        if pack:
+            answer = {paper_id.strip(): synthetic_analysis(rng) for paper_id in pack.group(1).split(",")}
+        else:
+            answer = synthetic_analysis(rng)
+        text = json.dumps(answer)
+        tokens = max(1, len(text) // 4)
+
+        latency = self.server.settings['latency']
+        tokens_per_second = self.server.settings['tokens_per_second']
+        generation = tokens / tokens_per_second if tokens_per_second else 0.0
+        final = {
+            'model': payload.get('model'), 'done': True,
+            'prompt_eval_count': len(payload['prompt']) // 4,
+            'prompt_eval_duration': int(latency * 1e9),
+            'eval_count': tokens,
+            'eval_duration': max(1, int(generation * 1e9)),
+        }
+
+        if payload.get('stream'):
+            self._stream(text, latency, generation, final)
+            return
+        time.sleep(latency + generation)
+        self._send(json.dumps({**final, 'response': text}).encode("utf-8"), "application/json")
+
+    def _stream(self, text: str, latency: float, generation: float, final: Dict):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        time.sleep(latency)
+        pieces = [text[i:i + 16] for i in range(0, len(text), 16)]
+        for piece in pieces:
+            time.sleep(generation / len(pieces))
+            self.wfile.write(json.dumps({'response': piece, 'done': False}).encode("utf-8") + b"\n")
+            self.wfile.flush()
+        self.wfile.write(json.dumps({**final, 'response': ''}).encode("utf-8") + b"\n")
+
+
+# Measurement
+
+def _current_rss() -> int:
+    """Resident set size of this process in bytes"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Not Linux: fall back to the lifetime peak (KiB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class RSSMonitor:
+    """Samples the process RSS from a background thread while the with-block runs"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.start = self.peak = 0
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        self.start = self.peak = _current_rss()
+        self._thread = threading.Thread(target=self._sample, name="rss-monitor", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _current_rss())
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, _current_rss())
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile of values, q in 0..100"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def _stage_result(stage: str, size: int, papers: int, elapsed: float, latencies: List[float],
+                  latency_unit: str, rss: RSSMonitor, failed: int = 0) -> Dict:
+    def ms(q):
+        value = percentile(latencies, q)
+        return round(value * 1000, 3) if value is not None else None
+
+    return {
+        'stage': stage,
+        'size': size,
+        'papers': papers,
+        'failed': failed,
+        'seconds': round(elapsed, 3),
+        'papers_per_sec': round(papers / elapsed, 1) if elapsed else None,
+        'latency_unit': latency_unit,
+        'p50_ms': ms(50),
+        'p95_ms': ms(95),
+        'p99_ms': ms(99),
+        'peak_rss_mb': round(rss.peak / 2 ** 20, 1),
+        'rss_growth_mb': round((rss.peak - rss.start) / 2 ** 20, 1),
+    }
+
+
+def _chunks(items: Iterable, size: int) -> Iterator[List]:
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# Stages
+
+def bench_collect(size: int, arxiv_url: str, page_size: int = PAPERS_PER_REQUEST) -> Dict:
+    """ArxivCollector.iter_papers; latency is the wait for each paper"""
+    collector = ArxivCollector(query="all:benchmark", page_size=page_size, delay_seconds=0, api_url=arxiv_url)
+    latencies = []
+    with RSSMonitor() as rss:
+        start = last = time.perf_counter()
+        for _ in collector.iter_papers(max_results=size):
+            now = time.perf_counter()
+            latencies.append(now - last)
+            last = now
+        elapsed = time.perf_counter() - start
+    return _stage_result("collect", size, len(latencies), elapsed, latencies, "paper", rss)
+
+
+def _timed_processor(ollama_url: str, latencies: List[float]) -> LLMProcessor:
+    """LLMProcessor whose packs record their latency once per paper"""
+    processor = LLMProcessor(BENCH_MODEL, use_cache=False, base_url=ollama_url)
+    process_pack = processor.process_pack
+
+    def timed_process_pack(pack):
+        start = time.perf_counter()
+        try:
+            return process_pack(pack)
+        finally:
+            latencies.extend([time.perf_counter() - start] * len(pack))
+
+    processor.process_pack = timed_process_pack
+    return processor
+
+
+def bench_llm(size: int, ollama_url: str, max_workers: int = LLM_MAX_CONCURRENCY,
+              pack_size: int = LLM_PACK_SIZE) -> Dict:
+    """LLMProcessor.iter_process_papers; latency is the request time per paper"""
+    latencies = []
+    papers = failed = 0
+    with _timed_processor(ollama_url, latencies) as processor, RSSMonitor() as rss:
+        start = time.perf_counter()
+        for paper in processor.iter_process_papers(synthetic_papers(size), max_workers=max_workers,
+                                                   pack_size=pack_size):
+            papers += 1
+            failed += paper.get('status') == 'failed'
+        elapsed = time.perf_counter() - start
+    return _stage_result("llm", size, papers, elapsed, latencies, "paper", rss, failed)
+
+
+def bench_save(size: int, db_path: str, batch_size: int = DB_BATCH_SIZE) -> Dict:
+    """Database.save_papers of analyzed papers; latency is per batch_size batch"""
+    db = Database(db_path)
+    latencies = []
+    papers = 0
+    with RSSMonitor() as rss:
+        start = time.perf_counter()
+        for batch in _chunks(map(_with_analysis, synthetic_papers(size)), batch_size):
+            batch_start = time.perf_counter()
+            db.save_papers(batch, batch_size=batch_size)
+            latencies.append(time.perf_counter() - batch_start)
+            papers += len(batch)
+        elapsed = time.perf_counter() - start
+    db.engine.dispose()
+    return _stage_result("save", size, papers, elapsed, latencies, "batch", rss)
+
+
+def bench_end_to_end(size: int, arxiv_url: str, ollama_url: str, db_path: str,
+                     max_workers: int = LLM_MAX_CONCURRENCY, pack_size: int = LLM_PACK_SIZE,
+                     page_size: int = PAPERS_PER_REQUEST, flush_size: int = DB_FLUSH_SIZE) -> Dict:
+    """
+    Collect, analyze and save through pipeline.stream_and_save, as
+    arxiv_streaming_flow does, including the unchanged-paper filter and
+    watermark updates; latency is the time from a paper's arrival from
+    arXiv until it is saved.
+    """
+    query = "all:benchmark"
+    collector = ArxivCollector(query=query, page_size=page_size, delay_seconds=0, api_url=arxiv_url)
+    db = Database(db_path)
+    collected_at = {}
+    latencies = []
+    skipped = Skipped()
+    failed = 0
+
+    def collected():
+        for paper in collector.iter_papers(max_results=size):
+            collected_at[paper['id']] = time.perf_counter()
+            yield paper
+
+    with LLMProcessor(BENCH_MODEL, use_cache=False, base_url=ollama_url) as processor, RSSMonitor() as rss:
+        start = time.perf_counter()
+        for batch in stream_and_save(collected(), db, query, skipped, processor,
+                                     max_workers=max_workers, flush_size=flush_size, pack_size=pack_size):
+            now = time.perf_counter()
+            latencies.extend(now - collected_at.pop(paper['id']) for paper in batch)
+            failed += sum(paper.get('status') == 'failed' for paper in batch)
+        elapsed = time.perf_counter() - start
+    db.engine.dispose()
+    return _stage_result("e2e", size, len(latencies), elapsed, latencies, "paper", rss, failed)
+
+
+def run_benchmark(sizes: List[int],
+                  stages: Iterable[str] = STAGES,
+                  llm_latency: float = 0.01,
+                  tokens_per_second: float = 0.0,
+                  max_workers: int = LLM_MAX_CONCURRENCY,
+                  pack_size: int = LLM_PACK_SIZE,
+                  page_size: int = PAPERS_PER_REQUEST,
+                  batch_size: int = DB_BATCH_SIZE,
+                  flush_size: int = DB_FLUSH_SIZE,
+                  seed: int = 0) -> List[Dict]:
+    """Run the selected stages at every size and return one result dict per run"""
+    arxiv = StandInServer(FakeArxivHandler, total=max(sizes), seed=seed)
+    ollama = StandInServer(FakeOllamaHandler, latency=llm_latency, tokens_per_second=tokens_per_second)
+    results = []
+    try:
+        for size in sizes:
+            for stage in stages:
+                with tempfile.TemporaryDirectory(prefix="arxiv-bench-") as tmp:
+                    db_path = os.path.join(tmp, "bench.db")
+                    if stage == "collect":
+                        result = bench_collect(size, arxiv.url + "/api/query", page_size)
+                    elif stage == "llm":
+                        result = bench_llm(size, ollama.url, max_workers, pack_size)
+                    elif stage == "save":
+                        result = bench_save(size, db_path, batch_size)
+                    elif stage == "e2e":
+                        result = bench_end_to_end(size, arxiv.url + "/api/query", ollama.url, db_path,
+                                                  max_workers, pack_size, page_size, flush_size)
+                    else:
+                        raise ValueError(f"Unknown stage: {stage}")
+                print(f"{stage} x {size}: {result['papers_per_sec']} papers/s", file=sys.stderr)
+                results.append(result)
+    finally:
+        arxiv.close()
+        ollama.close()
+    return results
+
+
+def format_results(results: List[Dict]) -> str:
+    header = (f"{'stage':<8}{'papers':>9}{'failed':>8}{'seconds':>10}{'papers/s':>10}"
+              f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  {'per':<6}{'peak RSS MB':>12}{'growth MB':>11}")
+    lines = [header, "-" * len(header)]
+    for r in results:
+        lines.append(
+            f"{r['stage']:<8}{r['papers']:>9}{r['failed']:>8}{r['seconds']:>10}{r['papers_per_sec']!s:>10}"
+            f"{r['p50_ms']!s:>10}{r['p95_ms']!s:>10}{r['p99_ms']!s:>10}  {r['latency_unit']:<6}"
+            f"{r['peak_rss_mb']:>12}{r['rss_growth_mb']:>11}"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmark of the ArXiv pipeline stages')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='Numbers of papers to run every stage with (default: 1000 10000 100000)')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES),
+                        help='Stages to run (default: all)')
+    parser.add_argument('--llm-latency', type=float, default=0.01,
+                        help='Fixed seconds per fake Ollama response (default: 0.01)')
+    parser.add_argument('--tokens-per-second', type=float, default=0.0,
+                        help='Fake Ollama generation speed, 0 for instant (default: 0)')
+    parser.add_argument('--max-workers', type=int, default=LLM_MAX_CONCURRENCY,
+                        help='LLM requests in flight')
+    parser.add_argument('--pack-size', type=int, default=LLM_PACK_SIZE,
+                        help='Papers per LLM request')
+    parser.add_argument('--page-size', type=int, default=PAPERS_PER_REQUEST,
+                        help='Papers per arXiv API page')
+    parser.add_argument('--batch-size', type=int, default=DB_BATCH_SIZE,
+                        help='Papers per save_papers call in the save stage')
+    parser.add_argument('--flush-size', type=int, default=DB_FLUSH_SIZE,
+                        help='Papers per database write in the end-to-end stage')
+    parser.add_argument('--json', dest='json_path',
+                        help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    loguru.logger.remove()
+    loguru.logger.add(sys.stderr, level="WARNING")
+    logging.getLogger().setLevel(logging.WARNING)
+    logger.setLevel(logging.WARNING)
+
+    results = run_benchmark(
+        args.sizes, args.stages,
+        llm_latency=args.llm_latency, tokens_per_second=args.tokens_per_second,
+        max_workers=args.max_workers, pack_size=args.pack_size, page_size=args.page_size,
+        batch_size=args.batch_size, flush_size=args.flush_size
+    )
+    print(format_results(results))
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({'created': datetime.now().isoformat(), 'args': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
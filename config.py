@@ -1,17 +1,82 @@
 import os
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
 # API Configuration
 ARXIV_API_BASE_URL = "http://export.arxiv.org/api/query"
 PAPERS_PER_REQUEST = 100
 WAIT_TIME = 3  # seconds between requests
 
+# HTTP client configuration (Ollama, Semantic Scholar)
+HTTP_POOL_SIZE = 10  # keep-alive connections per host
+HTTP_CONNECT_TIMEOUT = 5  # seconds
+HTTP_READ_TIMEOUT = 300  # seconds, local LLM generation can be slow
+HTTP_KEEPALIVE_EXPIRY = 60  # seconds, used by the HTTP/2 client
+HTTP_USE_HTTP2 = False  # requires httpx[http2]
+
+# Semantic Scholar Graph API
+BASE_URL = "https://api.semanticscholar.org/graph/v1"
+API_KEY = os.getenv("SEMANTIC_SCHOLAR_API_KEY")  # optional, raises the rate limit
+S2_BATCH_SIZE = 500  # ids per /paper/batch request, the API maximum
+S2_REQUESTS_PER_SECOND = 1  # the limit for a keyed client; unkeyed calls share a pool
+S2_MAX_RETRIES = 5  # retries of 429 and 5xx responses, with exponential backoff
+S2_REFRESH_DAYS = 30  # re-fetch citation counts older than this
+
 # Database Configuration
 DB_PATH = "arxiv_papers.db"
+DB_BATCH_SIZE = 500  # papers per upsert transaction
+DB_FLUSH_SIZE = 50  # analyzed papers per write in the streaming flow
+# Applied to every SQLite connection. WAL lets the dashboard read while the
+# pipeline writes; NORMAL sync is safe with WAL and much faster than FULL.
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,  # bytes
+    "cache_size": -64 * 1024,  # negative means KiB
+    "busy_timeout": 5000,  # milliseconds
+    "temp_store": "MEMORY",
+}
 
 # LLM Configuration
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OLLAMA_BASE_URL = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+LLM_MAX_CONCURRENCY = 4  # papers analyzed in parallel
+LLM_JSON_RETRIES = 2  # extra attempts when the model returns malformed JSON
+# Prompt packing: papers analyzed per request (1 disables packing). Keep
+# LLM_PACK_MAX_PROMPT_CHARS (titles + abstracts, ~4 chars per token) plus
+# LLM_TOKENS_PER_ANALYSIS per paper within the model's context length.
+LLM_PACK_SIZE = 1
+LLM_PACK_MAX_PROMPT_CHARS = 12000
+LLM_TOKENS_PER_ANALYSIS = 400
+LLM_CACHE_PATH = "llm_cache.db"
+LLM_CACHE_TTL = 30 * 24 * 3600  # seconds, None to keep responses forever
+LLM_CACHE_MAX_ENTRIES = 100_000
+LLM_HISTORY_SIZE = 1000  # requests kept in memory, None for unbounded
+LLM_HISTORY_FILE = None  # JSONL file each finished request is appended to
+# Async generation limits per provider, shared by all models in an event loop
+LLM_PROVIDER_CONCURRENCY = {"openai": 16, "ollama": 4}  # requests in flight
+LLM_TOKENS_PER_MINUTE = {"openai": 90_000}  # providers not listed are not limited
+
+# Embeddings and related-paper search
+EMBEDDING_MODEL = "ollama/nomic-embed-text"  # or e.g. "openai/text-embedding-3-small" with OPENAI_API_KEY
+EMBEDDING_BATCH_SIZE = 64  # texts per embedding request
+# Vectors live in <DB_PATH without extension>.embeddings next to the database.
+# Exact search over 1M 768-d vectors takes a few hundred ms; the HNSW index (requires
+# hnswlib) answers in about a millisecond at a small loss of recall.
+VECTOR_ANN = True
+VECTOR_ANN_MIN_ROWS = 100_000  # smaller corpora are searched exactly
+VECTOR_ANN_EF = 64  # HNSW search breadth, higher is more accurate and slower
+
+# Parquet export for the dashboard, partitioned by published month
+EXPORT_DIR = "data/export"
+# Also register the export as DuckDB views in this file (requires duckdb);
+# the dashboard's arxiv source reads "dashboard/sources/arxiv/arxiv.duckdb"
+EXPORT_DUCKDB_PATH = None
+
+# Metrics (Prometheus text format)
+METRICS_PORT = None  # serve /metrics on this port while the pipeline runs
+METRICS_TEXTFILE = None  # file written after each run, for node_exporter's textfile collector
 
 # Search parameters
 SEARCH_QUERY = "data engineering"
-START_DATE = datetime.now() - timedelta(days=30)
+# Naive UTC, like the arXiv timestamps and watermarks it is compared with
+START_DATE = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=30)
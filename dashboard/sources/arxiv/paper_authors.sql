@@ -0,0 +1 @@
+select * from paper_authors
@@ -1,21 +1,95 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, select, insert, delete, func, event, text, case, or_, and_
+from sqlalchemy.engine import Engine
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.exc import SQLAlchemyError
-from typing import List, Dict
-import uuid
-from datetime import datetime
+from typing import List, Dict, Optional, Tuple, Iterator, Sequence
+from datetime import datetime, date, timedelta
+from itertools import islice
+import json
+from collections import Counter, defaultdict
 from contextlib import contextmanager
+import threading
+import os
 
-from db_model import Base, Paper, Author, Category
-from config import DB_PATH
-from utils import logger
+from db_model import (
+    Base, Paper, Author, Category, HarvestState, Enrichment,
+    paper_authors, paper_categories, paper_embeddings, paper_references, export_queue,
+    paper_stats
+)
+from migrations import run_migrations, ensure_search_index, ensure_paper_stats, rebuild_paper_stats
+from config import DB_PATH, DB_BATCH_SIZE, SQLITE_PRAGMAS, S2_REFRESH_DAYS
+from vectorindex import VectorIndex
+from utils import logger, content_hash
+from metrics import DB_ROWS_WRITTEN, DB_WRITE_DURATION
+
+
+_engines: Dict[str, Engine] = {}
+_engines_lock = threading.Lock()
+
+# Stay well below SQLite's limit on bound parameters per statement
+SQLITE_MAX_PARAMS = 900
+
+
+def _chunks(values, size: int = SQLITE_MAX_PARAMS) -> Iterator[list]:
+    """Split values to bind in IN (...) into lists small enough for one statement"""
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+def get_engine(db_path: str = DB_PATH) -> Engine:
+    """
+    Return the process-wide engine for db_path.
+
+    The engine is created once per file: every new connection gets the
+    SQLITE_PRAGMAS profile, and migrations and schema creation run only
+    on first use.
+    """
+    with _engines_lock:
+        engine = _engines.get(db_path)
+        if engine is None:
+            engine = create_engine(f'sqlite:///{db_path}')
+            event.listen(engine, "connect", _apply_sqlite_pragmas)
+            run_migrations(engine)
+            Base.metadata.create_all(engine)
+            ensure_search_index(engine)
+            ensure_paper_stats(engine)
+            _engines[db_path] = engine
+        return engine
+
+
+_vector_indexes: Dict[str, VectorIndex] = {}
+
+
+def get_vector_index(path: str) -> VectorIndex:
+    """Return the process-wide vector index stored at path"""
+    with _engines_lock:
+        if path not in _vector_indexes:
+            _vector_indexes[path] = VectorIndex(path)
+        return _vector_indexes[path]
 
 
 class Database:
-    def __init__(self):
-        self.engine = create_engine(f'sqlite:///{DB_PATH}')
-        Base.metadata.create_all(self.engine)
+    def __init__(self, db_path: str = DB_PATH):
+        self.engine = get_engine(db_path)
         self.SessionLocal = sessionmaker(bind=self.engine)
+        self.vectors_path = os.path.splitext(db_path)[0] + '.embeddings'
+        self._vectors = None
+
+    @property
+    def vectors(self) -> VectorIndex:
+        """Abstract embeddings, see save_embeddings and similar"""
+        if self._vectors is None:
+            self._vectors = get_vector_index(self.vectors_path)
+        return self._vectors
 
     @contextmanager
     def get_session(self) -> Session:
@@ -29,87 +103,770 @@ class Database:
         finally:
             session.close()
 
-    def save_papers(self, papers: List[Dict]):
-        with self.get_session() as session:
-            for paper_data in papers:
-                try:
-                    # Create paper instance
-                    paper = Paper(
-                        id=paper_data['id'],
-                        title=paper_data['title'],
-                        abstract=paper_data['abstract'],
-                        published=datetime.strptime(paper_data['published'], '%Y-%m-%d').date(),
-                        updated=datetime.strptime(paper_data['updated'], '%Y-%m-%d').date(),
-                        llm_analysis=paper_data.get('llm_analysis')
-                    )
-
-                    # Add authors
-                    for author_name in paper_data['authors']:
-                        author = Author(
-                            id=str(uuid.uuid4()),
-                            author_name=author_name
-                        )
-                        paper.authors.append(author)
-
-                    # Add categories
-                    for category_name in paper_data['categories']:
-                        category = Category(
-                            id=str(uuid.uuid4()),
-                            category_name=category_name
-                        )
-                        paper.categories.append(category)
-
-                    # Merge paper (update if exists, insert if new)
-                    session.merge(paper)
-
-                except SQLAlchemyError as e:
-                    logger.error(f"Error saving paper {paper_data['id']}: {str(e)}")
-                    raise
+    def save_papers(self, papers: List[Dict], batch_size: int = DB_BATCH_SIZE) -> Dict[str, int]:
+        """
+        Upsert papers with their authors and categories.
 
-    def get_papers(self, limit: int = None) -> List[Dict]:
+        Each chunk of batch_size papers is written in one transaction with
+        multi-row INSERT ... ON CONFLICT DO UPDATE statements. An existing
+        analysis (llm_analysis and its structured fields) is kept when the
+        new record has none.
+
+        A paper's 'status' ('analyzed' or 'failed', as set by LLMProcessor)
+        counts as one analysis attempt; papers without it are saved as
+        'collected' and leave the stored processing state alone.
+
+        If the title or abstract changed (see 'content_hash'), the stored
+        analysis, processing state and embedding are dropped instead, so
+        the paper is analyzed again.
+
+        Returns counts of inserted and updated papers.
+        """
+        counts = {'inserted': 0, 'updated': 0}
+        for start in range(0, len(papers), batch_size):
+            chunk = papers[start:start + batch_size]
+            try:
+                with DB_WRITE_DURATION.time(), self.get_session() as session:
+                    inserted, updated = self._upsert_chunk(session, chunk)
+            except SQLAlchemyError as e:
+                logger.error(f"Error saving papers {start}-{start + len(chunk)}: {str(e)}")
+                raise
+            counts['inserted'] += inserted
+            counts['updated'] += updated
+
+        logger.info(f"Saved papers: {counts['inserted']} inserted, {counts['updated']} updated")
+        return counts
+
+    def _upsert_chunk(self, session: Session, papers: List[Dict]) -> Tuple[int, int]:
+        # Later duplicates of the same id within a chunk win, as with merge()
+        papers = list({paper['id']: paper for paper in papers}.values())
+        paper_ids = [paper['id'] for paper in papers]
+        stored = [
+            row
+            for part in _chunks(paper_ids)
+            for row in session.execute(
+                select(Paper.id, Paper.content_hash, Paper.published).where(Paper.id.in_(part))
+            )
+        ]
+        existing = {paper_id: stored_hash for paper_id, stored_hash, _ in stored}
+        hashes = {paper['id']: self._content_hash(paper) for paper in papers}
+        stats_before, authors_before = self._stats_of(session, list(existing))
+
+        paper_rows = [
+            {
+                **self._processing_state(paper),
+                'id': paper['id'],
+                'title': paper['title'],
+                'abstract': paper['abstract'],
+                'published': date.fromisoformat(paper['published']),
+                'updated': date.fromisoformat(paper['updated']),
+                'version': paper.get('version'),
+                'content_hash': hashes[paper['id']],
+                'llm_analysis': paper.get('llm_analysis'),
+                'main_topic': paper.get('main_topic'),
+                'key_findings': json.dumps(paper['key_findings'], ensure_ascii=False)
+                if paper.get('key_findings') is not None else None,
+                'complexity': paper.get('complexity')
+            }
+            for paper in papers
+        ]
+        stmt = sqlite_insert(Paper)
+        # Stored analysis and state only carry over while the text is the same
+        same_text = Paper.content_hash == stmt.excluded.content_hash
+        keep_state = and_(stmt.excluded.status == 'collected', same_text)
+
+        def kept(column):
+            return func.coalesce(stmt.excluded[column.key], case((same_text, column)))
+
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Paper.id],
+            set_={
+                'title': stmt.excluded.title,
+                'abstract': stmt.excluded.abstract,
+                'published': stmt.excluded.published,
+                'updated': stmt.excluded.updated,
+                'version': func.coalesce(stmt.excluded.version, Paper.version),
+                'content_hash': stmt.excluded.content_hash,
+                'llm_analysis': kept(Paper.llm_analysis),
+                'main_topic': kept(Paper.main_topic),
+                'key_findings': kept(Paper.key_findings),
+                'complexity': kept(Paper.complexity),
+                'status': case((keep_state, Paper.status), else_=stmt.excluded.status),
+                'attempts': case((same_text, Paper.attempts + stmt.excluded.attempts), else_=stmt.excluded.attempts),
+                'llm_model': kept(Paper.llm_model),
+                'prompt_version': kept(Paper.prompt_version),
+                'llm_error': case((keep_state, Paper.llm_error), else_=stmt.excluded.llm_error)
+            }
+        )
+        session.execute(stmt, paper_rows)
+
+        # Embeddings of changed abstracts are stale, drop them to be recomputed
+        changed = [paper_id for paper_id, stored in existing.items() if stored != hashes[paper_id]]
+        for part in _chunks(changed):
+            session.execute(delete(paper_embeddings).where(paper_embeddings.c.paper_id.in_(part)))
+
+        # Paper links are replaced wholesale, author and category entities are shared
+        for part in _chunks(existing):
+            session.execute(delete(paper_authors).where(paper_authors.c.paper_id.in_(part)))
+            session.execute(delete(paper_categories).where(paper_categories.c.paper_id.in_(part)))
+
+        author_ids = self._get_or_create_ids(
+            session, Author, 'author_name', {name for paper in papers for name in paper['authors']}
+        )
+        category_ids = self._get_or_create_ids(
+            session, Category, 'category_name', {name for paper in papers for name in paper['categories']}
+        )
+
+        author_rows = [
+            {'paper_id': paper['id'], 'position': i, 'author_id': author_ids[name]}
+            for paper in papers
+            for i, name in enumerate(paper['authors'])
+        ]
+        category_rows = [
+            {'paper_id': paper['id'], 'category_id': category_ids[name]}
+            for paper in papers
+            for name in dict.fromkeys(paper['categories'])
+        ]
+        if author_rows:
+            session.execute(insert(paper_authors), author_rows)
+        if category_rows:
+            session.execute(insert(paper_categories), category_rows)
+
+        # Summary counts change by what the papers contribute now minus before
+        stats = Counter()
+        for row, paper in zip(paper_rows, papers):
+            stats.update(self._paper_stats_keys(row['published'], len(paper['authors'])))
+            stats.update(('category', name) for name in dict.fromkeys(paper['categories']))
+        stats.subtract(stats_before)
+        authors_after = {row['author_id'] for row in author_rows}
+        stats[('total', 'authors')] += self._linked_authors_delta(
+            session, authors_before, authors_after, Counter(row['author_id'] for row in author_rows)
+        )
+        self._update_stats(session, stats)
+
+        # Both the old and the new month of a paper are affected by a save
+        self._queue_export(session, [row['published'] for row in paper_rows] +
+                           [published for _, _, published in stored])
+
+        DB_ROWS_WRITTEN.inc(len(paper_rows), table='papers')
+        DB_ROWS_WRITTEN.inc(len(author_rows), table='paper_authors')
+        DB_ROWS_WRITTEN.inc(len(category_rows), table='paper_categories')
+
+        return len(papers) - len(existing), len(existing)
+
+    @staticmethod
+    def _paper_stats_keys(published: Optional[date], authors: int) -> List[Tuple[str, str]]:
+        keys = [('total', 'papers'), ('authors_per_paper', str(authors))]
+        if published is not None:
+            keys.append(('month', published.strftime('%Y-%m')))
+        return keys
+
+    def _stats_of(self, session: Session, paper_ids: List[str]) -> Tuple[Counter, set]:
+        """Summary counts contributed by stored papers, and the ids of their authors"""
+        stats = Counter()
+        author_ids = set()
+        for part in _chunks(paper_ids):
+            rows = session.execute(
+                select(Paper.published, func.count(paper_authors.c.author_id))
+                .outerjoin(paper_authors, paper_authors.c.paper_id == Paper.id)
+                .where(Paper.id.in_(part))
+                .group_by(Paper.id)
+            )
+            for published, authors in rows:
+                stats.update(self._paper_stats_keys(published, authors))
+            stats.update(('category', name) for name in session.scalars(
+                select(Category.category_name)
+                .join(paper_categories, paper_categories.c.category_id == Category.id)
+                .where(paper_categories.c.paper_id.in_(part))
+            ))
+            author_ids.update(session.scalars(
+                select(paper_authors.c.author_id).where(paper_authors.c.paper_id.in_(part)).distinct()
+            ))
+        return stats, author_ids
+
+    @staticmethod
+    def _linked_authors_delta(session: Session, before: set, after: set, chunk_links: Counter) -> int:
+        """
+        Change in the number of authors with at least one paper, when the
+        papers of a chunk were linked to the authors before and now to after.
+        chunk_links counts the chunk's current links per author.
+        """
+        touched = list(before | after)
+        # Authors who also have papers outside the chunk stay linked either way
+        elsewhere = set()
+        for part in _chunks(touched):
+            links = session.execute(
+                select(paper_authors.c.author_id, func.count())
+                .where(paper_authors.c.author_id.in_(part))
+                .group_by(paper_authors.c.author_id)
+            )
+            elsewhere.update(author_id for author_id, count in links if count > chunk_links[author_id])
+        return len(elsewhere | after) - len(elsewhere | before)
+
+    @staticmethod
+    def _update_stats(session: Session, stats: Counter):
+        rows = [{'kind': kind, 'key': key, 'count': count} for (kind, key), count in stats.items() if count]
+        if not rows:
+            return
+        stmt = sqlite_insert(paper_stats)
+        session.execute(
+            stmt.on_conflict_do_update(index_elements=[paper_stats.c.kind, paper_stats.c.key],
+                                       set_={'count': paper_stats.c.count + stmt.excluded.count}),
+            rows
+        )
+        session.execute(delete(paper_stats).where(paper_stats.c.count <= 0, paper_stats.c.kind != 'total'))
+
+    def get_summary(self) -> Dict:
+        """
+        Corpus statistics, read from the paper_stats rollup that save_papers
+        and delete_paper keep current, so the cost does not grow with the
+        number of papers.
+        """
+        stats = defaultdict(dict)
         with self.get_session() as session:
-            query = session.query(Paper)
-            if limit:
-                query = query.limit(limit)
+            for kind, key, count in session.execute(select(paper_stats)):
+                stats[kind][key] = count
 
-            papers = query.all()
-            return [self._paper_to_dict(paper) for paper in papers]
+        total = stats['total'].get('papers', 0)
+        months = sorted(stats['month'])
+        authors_per_paper = {int(key): count for key, count in stats['authors_per_paper'].items()}
+        return {
+            'total_papers': total,
+            'unique_authors': stats['total'].get('authors', 0),
+            'date_range': f"{months[0]} - {months[-1]}" if months else 'N/A',
+            'papers_per_month': {month: stats['month'][month] for month in months},
+            'papers_per_category': dict(sorted(stats['category'].items(), key=lambda item: (-item[1], item[0]))),
+            'authors_per_paper': dict(sorted(authors_per_paper.items())),
+            'mean_authors_per_paper':
+                sum(authors * count for authors, count in authors_per_paper.items()) / total if total else 0.0
+        }
 
-    def get_paper_by_id(self, paper_id: str) -> Dict:
+    def rebuild_summary(self):
+        """Recompute the paper_stats rollup from scratch"""
+        with self.engine.begin() as conn:
+            rebuild_paper_stats(conn)
+
+    @staticmethod
+    def _queue_export(session: Session, published_dates):
+        months = {published.strftime('%Y-%m') for published in published_dates if published is not None}
+        if not months:
+            return
+        stmt = sqlite_insert(export_queue)
+        session.execute(
+            stmt.on_conflict_do_update(index_elements=[export_queue.c.month],
+                                       set_={'queued_at': stmt.excluded.queued_at}),
+            [{'month': month, 'queued_at': datetime.utcnow()} for month in sorted(months)]
+        )
+
+    def get_export_queue(self) -> Dict[str, datetime]:
+        """Published months changed since their last export, with the time of the latest change"""
         with self.get_session() as session:
-            paper = session.query(Paper).filter(Paper.id == paper_id).first()
-            if paper:
-                return self._paper_to_dict(paper)
-            return None
+            return dict(session.execute(select(export_queue.c.month, export_queue.c.queued_at)).all())
+
+    def clear_export_queue(self, queue: Dict[str, datetime]):
+        """Dequeue exported months, unless they changed again after get_export_queue"""
+        with self.get_session() as session:
+            for month, queued_at in queue.items():
+                session.execute(delete(export_queue).where(export_queue.c.month == month,
+                                                           export_queue.c.queued_at == queued_at))
+
+    def get_published_months(self) -> List[str]:
+        """All published months ('YYYY-MM') with papers, oldest first"""
+        month = func.strftime('%Y-%m', Paper.published)
+        with self.get_session() as session:
+            return list(session.scalars(
+                select(month).where(Paper.published.is_not(None)).distinct().order_by(month)
+            ))
+
+    @staticmethod
+    def _content_hash(paper: Dict) -> str:
+        return paper.get('content_hash') or content_hash(paper['title'], paper['abstract'])
 
-    def _paper_to_dict(self, paper: Paper) -> Dict:
+    def filter_changed(self, papers: List[Dict]) -> List[Dict]:
+        """
+        Drop papers that need neither analysis nor saving: already analyzed,
+        with the same title and abstract as stored. Papers that are new,
+        whose text changed, or whose analysis is missing or failed are kept.
+        """
+        hashes = {paper['id']: self._content_hash(paper) for paper in papers}
+        unchanged = set()
+        with self.get_session() as session:
+            for part in _chunks(hashes):
+                rows = session.execute(
+                    select(Paper.id, Paper.content_hash)
+                    .where(Paper.id.in_(part), Paper.status == 'analyzed')
+                )
+                unchanged.update(paper_id for paper_id, stored in rows if stored == hashes[paper_id])
+        if unchanged:
+            logger.info(f"Skipping {len(unchanged)} of {len(hashes)} papers with unchanged text")
+        return [paper for paper in papers if paper['id'] not in unchanged]
+
+    @staticmethod
+    def _processing_state(paper: Dict) -> Dict:
+        status = paper.get('status') or 'collected'
+        if status == 'collected':
+            return {'status': status, 'attempts': 0, 'llm_model': None, 'prompt_version': None, 'llm_error': None}
         return {
-            'id': paper.id,
-            'title': paper.title,
-            'abstract': paper.abstract,
-            'published': paper.published.strftime('%Y-%m-%d'),
-            'updated': paper.updated.strftime('%Y-%m-%d'),
-            'llm_analysis': paper.llm_analysis,
-            'authors': [author.author_name for author in paper.authors],
-            'categories': [category.category_name for category in paper.categories]
+            'status': status,
+            'attempts': 1,
+            'llm_model': paper.get('llm_model') if status == 'analyzed' else None,
+            'prompt_version': paper.get('prompt_version') if status == 'analyzed' else None,
+            'llm_error': paper.get('llm_error')
         }
 
-    def get_papers_by_category(self, category: str) -> List[Dict]:
+    @staticmethod
+    def _get_or_create_ids(session: Session, model, name_field: str, names) -> Dict[str, int]:
+        """Insert missing names into an entity table and return their ids"""
+        name_column = getattr(model, name_field)
+        ids = {}
+        for part in _chunks(names):
+            session.execute(
+                sqlite_insert(model).on_conflict_do_nothing(index_elements=[name_column]),
+                [{name_field: name} for name in part]
+            )
+            ids.update(session.execute(
+                select(name_column, model.id).where(name_column.in_(part))
+            ).all())
+        return ids
+
+    # Plain columns selected by the read API; rows are tuples, not ORM objects
+    PAPER_COLUMNS = (Paper.id, Paper.title, Paper.abstract, Paper.published, Paper.updated,
+                     Paper.version, Paper.content_hash, Paper.llm_analysis,
+                     Paper.main_topic, Paper.key_findings, Paper.complexity,
+                     Paper.status, Paper.attempts, Paper.llm_model, Paper.prompt_version, Paper.llm_error)
+
+    def get_papers(self, limit: int = None) -> List[Dict]:
+        query = select(*self.PAPER_COLUMNS)
+        if limit:
+            query = query.limit(limit)
+        return self._fetch_papers(query)
+
+    def get_paper_by_id(self, paper_id: str) -> Dict:
+        papers = self._fetch_papers(select(*self.PAPER_COLUMNS).where(Paper.id == paper_id))
+        if papers:
+            return papers[0]
+        return None
+
+    def has_paper(self, paper_id: str) -> bool:
         with self.get_session() as session:
-            papers = session.query(Paper).join(Category).filter(
-                Category.category_name == category
-            ).all()
-            return [self._paper_to_dict(paper) for paper in papers]
+            return session.execute(select(Paper.id).where(Paper.id == paper_id)).first() is not None
+
+    def get_papers_by_category(self, category: str) -> List[Dict]:
+        query = (
+            select(*self.PAPER_COLUMNS)
+            .join(paper_categories, paper_categories.c.paper_id == Paper.id)
+            .join(Category, Category.id == paper_categories.c.category_id)
+            .where(Category.category_name == category)
+        )
+        return self._fetch_papers(query)
 
     def get_papers_by_author(self, author_name: str) -> List[Dict]:
+        query = (
+            select(*self.PAPER_COLUMNS)
+            .join(paper_authors, paper_authors.c.paper_id == Paper.id)
+            .join(Author, Author.id == paper_authors.c.author_id)
+            .where(Author.author_name == author_name)
+            .distinct()
+        )
+        return self._fetch_papers(query)
+
+    def iter_papers(self,
+                    chunk_size: int = DB_BATCH_SIZE,
+                    published_from: Optional[date] = None,
+                    published_to: Optional[date] = None,
+                    category: Optional[str] = None,
+                    author: Optional[str] = None) -> Iterator[Dict]:
+        """
+        Lazily yield papers ordered by id, chunk_size at a time.
+
+        Uses keyset pagination on Paper.id with a short session per chunk,
+        so memory use does not grow with the size of the table. Filters
+        are optional; the published range is inclusive.
+        """
+        query = select(*self.PAPER_COLUMNS)
+        if published_from is not None:
+            query = query.where(Paper.published >= published_from)
+        if published_to is not None:
+            query = query.where(Paper.published <= published_to)
+        if category is not None:
+            query = query.where(Paper.id.in_(
+                select(paper_categories.c.paper_id)
+                .join(Category, Category.id == paper_categories.c.category_id)
+                .where(Category.category_name == category)
+            ))
+        if author is not None:
+            query = query.where(Paper.id.in_(
+                select(paper_authors.c.paper_id)
+                .join(Author, Author.id == paper_authors.c.author_id)
+                .where(Author.author_name == author)
+            ))
+
+        return self._iter_keyset(query, chunk_size)
+
+    def iter_papers_to_analyze(self,
+                               model_name: Optional[str] = None,
+                               prompt_version: Optional[str] = None,
+                               limit: Optional[int] = None,
+                               chunk_size: int = DB_BATCH_SIZE) -> Iterator[Dict]:
+        """
+        Lazily yield papers that still need an LLM analysis.
+
+        These are papers never analyzed ('collected') and papers whose last
+        attempt failed. If model_name or prompt_version is given, analyzed
+        papers whose stored value differs are yielded too, for re-analysis.
+        """
+        condition = Paper.status.in_(('collected', 'failed'))
+        stale = []
+        if model_name is not None:
+            stale.append(or_(Paper.llm_model.is_(None), Paper.llm_model != model_name))
+        if prompt_version is not None:
+            stale.append(or_(Paper.prompt_version.is_(None), Paper.prompt_version != prompt_version))
+        if stale:
+            condition = or_(condition, and_(Paper.status == 'analyzed', or_(*stale)))
+
+        return islice(self._iter_keyset(select(*self.PAPER_COLUMNS).where(condition), chunk_size), limit)
+
+    def count_by_status(self) -> Dict[str, int]:
+        with self.get_session() as session:
+            return dict(session.execute(select(Paper.status, func.count()).group_by(Paper.status)).all())
+
+    def _iter_keyset(self, query, chunk_size: int) -> Iterator[Dict]:
+        # Each chunk is read in its own short session, so rows may be
+        # updated by the consumer while the iteration is in progress
+        last_id = None
+        while True:
+            page = query if last_id is None else query.where(Paper.id > last_id)
+            papers = self._fetch_papers(page.order_by(Paper.id).limit(chunk_size))
+            yield from papers
+            if len(papers) < chunk_size:
+                return
+            last_id = papers[-1]['id']
+
+    def search(self, query: str, limit: int = 20, offset: int = 0, raw: bool = False) -> List[Dict]:
+        """
+        Full-text search over titles, abstracts and the main topics and key
+        findings of LLM analyses.
+
+        Results are ordered by BM25 relevance (titles weigh most) and carry
+        'score' (lower is better) and a highlighted 'snippet'. Unless raw is
+        set, every word of query is matched literally; with raw=True the
+        query is passed through as FTS5 syntax (phrases, OR, prefix*).
+        """
+        if not raw:
+            query = " ".join('"' + term.replace('"', '""') + '"' for term in query.split())
+        if not query:
+            return []
+
+        sql = text(
+            "SELECT p.id, p.title, p.abstract, p.published, p.updated, "
+            "       p.version, p.content_hash, p.llm_analysis, p.main_topic, p.key_findings, p.complexity, "
+            "       p.status, p.attempts, p.llm_model, p.prompt_version, p.llm_error, "
+            "       bm25(papers_fts, 10.0, 5.0, 2.0, 1.0) AS score, "
+            "       snippet(papers_fts, -1, '[', ']', '...', 16) AS snippet "
+            "FROM papers_fts JOIN papers p ON p.rowid = papers_fts.rowid "
+            "WHERE papers_fts MATCH :query "
+            "ORDER BY score LIMIT :limit OFFSET :offset"
+        ).columns(*self.PAPER_COLUMNS)
+
+        with self.get_session() as session:
+            papers = []
+            for row in session.execute(sql, {'query': query, 'limit': limit, 'offset': offset}):
+                paper = self._row_to_dict(row[:len(self.PAPER_COLUMNS)])
+                paper['score'] = row.score
+                paper['snippet'] = row.snippet
+                papers.append(paper)
+            self._attach_relations(session, papers)
+        return papers
+
+    def _fetch_papers(self, query) -> List[Dict]:
+        """
+        Run a papers query and attach authors and categories.
+
+        Relations are loaded with one batched query per relation for every
+        SQLITE_MAX_PARAMS papers, instead of lazy loads per paper.
+        """
         with self.get_session() as session:
-            papers = session.query(Paper).join(Author).filter(
-                Author.author_name == author_name
+            papers = [self._row_to_dict(row) for row in session.execute(query)]
+            self._attach_relations(session, papers)
+        return papers
+
+    @staticmethod
+    def _attach_relations(session: Session, papers: List[Dict]):
+        by_id = {paper['id']: paper for paper in papers}
+        for part in _chunks(by_id):
+            author_rows = session.execute(
+                select(paper_authors.c.paper_id, Author.author_name)
+                .join(Author, Author.id == paper_authors.c.author_id)
+                .where(paper_authors.c.paper_id.in_(part))
+                .order_by(paper_authors.c.paper_id, paper_authors.c.position)
+            )
+            for paper_id, author_name in author_rows:
+                by_id[paper_id]['authors'].append(author_name)
+
+            category_rows = session.execute(
+                select(paper_categories.c.paper_id, Category.category_name)
+                .join(Category, Category.id == paper_categories.c.category_id)
+                .where(paper_categories.c.paper_id.in_(part))
+            )
+            for paper_id, category_name in category_rows:
+                by_id[paper_id]['categories'].append(category_name)
+
+    @staticmethod
+    def _row_to_dict(row) -> Dict:
+        (paper_id, title, abstract, published, updated,
+         version, paper_hash, llm_analysis, main_topic, key_findings, complexity,
+         status, attempts, llm_model, prompt_version, llm_error) = row
+        return {
+            'id': paper_id,
+            'title': title,
+            'abstract': abstract,
+            'published': published.strftime('%Y-%m-%d') if published else None,
+            'updated': updated.strftime('%Y-%m-%d') if updated else None,
+            'version': version,
+            'content_hash': paper_hash,
+            'llm_analysis': llm_analysis,
+            'main_topic': main_topic,
+            'key_findings': json.loads(key_findings) if key_findings else None,
+            'complexity': complexity,
+            'status': status,
+            'attempts': attempts,
+            'llm_model': llm_model,
+            'prompt_version': prompt_version,
+            'llm_error': llm_error,
+            'authors': [],
+            'categories': []
+        }
+
+    def save_embeddings(self, embeddings: Dict[str, Sequence[float]], model: str):
+        """
+        Store abstract embeddings computed by model, keyed by paper id.
+
+        Vectors of papers embedded before overwrite their row in the vector
+        file, others are appended; paper_embeddings maps papers to rows.
+        """
+        if not embeddings:
+            return
+        paper_ids = list(embeddings)
+        with self.get_session() as session:
+            rows = {}
+            for part in _chunks(paper_ids):
+                rows.update(session.execute(
+                    select(paper_embeddings.c.paper_id, paper_embeddings.c.row)
+                    .where(paper_embeddings.c.paper_id.in_(part))
+                ).all())
+            known = [paper_id for paper_id in paper_ids if paper_id in rows]
+            new = [paper_id for paper_id in paper_ids if paper_id not in rows]
+            if known:
+                self.vectors.update([rows[paper_id] for paper_id in known],
+                                    [embeddings[paper_id] for paper_id in known])
+            if new:
+                rows.update(zip(new, self.vectors.append([embeddings[paper_id] for paper_id in new]).tolist()))
+
+            stmt = sqlite_insert(paper_embeddings)
+            session.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=[paper_embeddings.c.paper_id],
+                    set_={'row': stmt.excluded.row, 'model': stmt.excluded.model}
+                ),
+                [{'paper_id': paper_id, 'row': rows[paper_id], 'model': model} for paper_id in paper_ids]
+            )
+        DB_ROWS_WRITTEN.inc(len(paper_ids), table='paper_embeddings')
+
+    def iter_papers_without_embedding(self,
+                                      model: str,
+                                      limit: Optional[int] = None,
+                                      chunk_size: int = DB_BATCH_SIZE) -> Iterator[Dict]:
+        """Lazily yield papers with no embedding from model, see iter_papers"""
+        embedded = select(paper_embeddings.c.paper_id).where(paper_embeddings.c.model == model)
+        query = select(*self.PAPER_COLUMNS).where(Paper.id.not_in(embedded))
+        return islice(self._iter_keyset(query, chunk_size), limit)
+
+    def similar(self, paper_id: str, k: int = 10) -> List[Dict]:
+        """
+        Papers whose abstracts are closest to paper_id's by embedding cosine
+        similarity, best first, each with a 'similarity' in [-1, 1].
+        Returns [] if the paper has no embedding yet.
+        """
+        with self.get_session() as session:
+            source = session.execute(
+                select(paper_embeddings.c.row, paper_embeddings.c.model)
+                .where(paper_embeddings.c.paper_id == paper_id)
+            ).first()
+        if source is None:
+            logger.warning(f"No embedding for paper {paper_id}")
+            return []
+
+        # Over-fetch: the paper itself and rows of deleted papers are dropped
+        rows, scores = self.vectors.search(self.vectors.vector(source.row), 2 * k + 1)
+        with self.get_session() as session:
+            row_papers = {}
+            for part in _chunks(rows.tolist()):
+                row_papers.update(session.execute(
+                    select(paper_embeddings.c.row, paper_embeddings.c.paper_id)
+                    .where(paper_embeddings.c.row.in_(part), paper_embeddings.c.model == source.model)
+                ).all())
+        ranked = [
+            (row_papers[row], float(score)) for row, score in zip(rows.tolist(), scores)
+            if row in row_papers and row_papers[row] != paper_id
+        ][:k]
+
+        papers = {
+            paper['id']: paper
+            for part in _chunks(similar_id for similar_id, _ in ranked)
+            for paper in self._fetch_papers(select(*self.PAPER_COLUMNS).where(Paper.id.in_(part)))
+        }
+        results = []
+        for similar_id, score in ranked:
+            if similar_id in papers:
+                papers[similar_id]['similarity'] = score
+                results.append(papers[similar_id])
+        return results
+
+    def drop_embeddings(self):
+        """Forget all embeddings, e.g. before switching to a model of another dimension"""
+        with self.get_session() as session:
+            session.execute(delete(paper_embeddings))
+        vectors = self.vectors
+        with _engines_lock:
+            _vector_indexes.pop(self.vectors_path, None)
+        self._vectors = None
+        for path in (vectors.path, vectors.meta_path, vectors.ann_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    ENRICHMENT_COLUMNS = ('found', 'fetched_at', 's2_paper_id', 'venue', 'year',
+                          'citation_count', 'reference_count', 'influential_citation_count')
+
+    def save_enrichment(self, records: List[Dict]):
+        """
+        Store Semantic Scholar records (see SemanticScholarClient.enrich_papers).
+
+        Each record replaces the paper's previous enrichment and references.
+        """
+        if not records:
+            return
+        paper_ids = [record['paper_id'] for record in records]
+        enrichment_rows = [
+            {'paper_id': record['paper_id'], **{column: record.get(column) for column in self.ENRICHMENT_COLUMNS}}
+            for record in records
+        ]
+        reference_rows = list({
+            (record['paper_id'], reference['cited_s2_id']): {'paper_id': record['paper_id'], **reference}
+            for record in records
+            for reference in record.get('references', [])
+        }.values())
+
+        with DB_WRITE_DURATION.time(), self.get_session() as session:
+            stmt = sqlite_insert(Enrichment)
+            session.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=[Enrichment.paper_id],
+                    set_={column: stmt.excluded[column] for column in self.ENRICHMENT_COLUMNS}
+                ),
+                enrichment_rows
+            )
+            for part in _chunks(paper_ids):
+                session.execute(delete(paper_references).where(paper_references.c.paper_id.in_(part)))
+            if reference_rows:
+                session.execute(insert(paper_references), reference_rows)
+        DB_ROWS_WRITTEN.inc(len(enrichment_rows), table='paper_enrichment')
+        DB_ROWS_WRITTEN.inc(len(reference_rows), table='paper_references')
+
+    def iter_ids_to_enrich(self,
+                           max_age_days: Optional[int] = S2_REFRESH_DAYS,
+                           limit: Optional[int] = None,
+                           chunk_size: int = DB_BATCH_SIZE) -> Iterator[str]:
+        """
+        Lazily yield ids of papers never enriched, or enriched more than
+        max_age_days ago (None never refreshes), ordered by id.
+        """
+        condition = Enrichment.paper_id.is_(None)
+        if max_age_days is not None:
+            condition = or_(condition, Enrichment.fetched_at < datetime.utcnow() - timedelta(days=max_age_days))
+        query = (
+            select(Paper.id)
+            .outerjoin(Enrichment, Enrichment.paper_id == Paper.id)
+            .where(condition)
+            .order_by(Paper.id)
+            .limit(chunk_size)
+        )
+
+        def ids():
+            last_id = None
+            while True:
+                with self.get_session() as session:
+                    page = session.scalars(query if last_id is None else query.where(Paper.id > last_id)).all()
+                yield from page
+                if len(page) < chunk_size:
+                    return
+                last_id = page[-1]
+
+        return islice(ids(), limit)
+
+    def get_enrichment(self, paper_id: str) -> Optional[Dict]:
+        """Semantic Scholar metadata of a paper with its 'references', or None if not enriched yet"""
+        with self.get_session() as session:
+            enrichment = session.get(Enrichment, paper_id)
+            if enrichment is None:
+                return None
+            result = {column: getattr(enrichment, column) for column in self.ENRICHMENT_COLUMNS}
+            result['fetched_at'] = enrichment.fetched_at.isoformat()
+            result['references'] = [
+                dict(row._mapping) for row in session.execute(
+                    select(paper_references.c.cited_s2_id, paper_references.c.cited_arxiv_id)
+                    .where(paper_references.c.paper_id == paper_id)
+                    .order_by(paper_references.c.cited_s2_id)
+                )
+            ]
+        return result
+
+    def get_cited_papers(self, paper_id: str) -> List[Dict]:
+        """Stored papers that paper_id cites, joined on their arXiv id"""
+        with self.get_session() as session:
+            cited = session.scalars(
+                select(paper_references.c.cited_arxiv_id)
+                .where(paper_references.c.paper_id == paper_id, paper_references.c.cited_arxiv_id.is_not(None))
             ).all()
-            return [self._paper_to_dict(paper) for paper in papers]
+        papers = [
+            paper
+            for part in _chunks(cited)
+            for paper in self._fetch_papers(select(*self.PAPER_COLUMNS).where(Paper.id.in_(part)))
+        ]
+        return sorted(papers, key=lambda paper: paper['id'])
+
+    def get_watermark(self, query: str) -> Optional[datetime]:
+        with self.get_session() as session:
+            state = session.get(HarvestState, query)
+            return state.last_updated if state else None
+
+    def update_watermark(self, query: str, papers: List[Dict]):
+        """Moves the query watermark forward to the newest 'updated_at' in papers"""
+        stamped = [p for p in papers if p.get('updated_at')]
+        if not stamped:
+            return
+
+        newest = max(stamped, key=lambda p: p['updated_at'])
+        last_updated = datetime.fromisoformat(newest['updated_at'])
+        with self.get_session() as session:
+            state = session.get(HarvestState, query)
+            if state is None:
+                session.add(HarvestState(query=query, last_updated=last_updated))
+            elif last_updated > state.last_updated:
+                state.last_updated = last_updated
+        logger.info(f"Harvest watermark for '{query}' is now {last_updated.isoformat()}")
 
     def delete_paper(self, paper_id: str):
         with self.get_session() as session:
             paper = session.query(Paper).filter(Paper.id == paper_id).first()
             if paper:
+                stats, authors = self._stats_of(session, [paper_id])
+                session.execute(delete(paper_authors).where(paper_authors.c.paper_id == paper_id))
+                session.execute(delete(paper_categories).where(paper_categories.c.paper_id == paper_id))
+                session.execute(delete(paper_embeddings).where(paper_embeddings.c.paper_id == paper_id))
+                session.execute(delete(paper_references).where(paper_references.c.paper_id == paper_id))
+                session.execute(delete(Enrichment).where(Enrichment.paper_id == paper_id))
+                self._queue_export(session, [paper.published])
                 session.delete(paper)
+                stats = Counter({key: -count for key, count in stats.items()})
+                stats[('total', 'authors')] += self._linked_authors_delta(session, authors, set(), Counter())
+                self._update_stats(session, stats)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Date, ForeignKey, create_engine
+from sqlalchemy import Column, String, Integer, Boolean, Date, DateTime, ForeignKey, Table, Index, create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -6,36 +6,133 @@ from config import DB_PATH
 
 Base = declarative_base()
 
+# Association tables: the primary keys index lookups by paper,
+# the extra indexes serve lookups by author and by category
+paper_authors = Table(
+    'paper_authors',
+    Base.metadata,
+    Column('paper_id', String, ForeignKey('papers.id', ondelete='CASCADE'), primary_key=True),
+    Column('position', Integer, primary_key=True),
+    Column('author_id', Integer, ForeignKey('authors.id'), nullable=False),
+    Index('ix_paper_authors_author_id', 'author_id')
+)
+
+paper_categories = Table(
+    'paper_categories',
+    Base.metadata,
+    Column('paper_id', String, ForeignKey('papers.id', ondelete='CASCADE'), primary_key=True),
+    Column('category_id', Integer, ForeignKey('categories.id'), primary_key=True),
+    Index('ix_paper_categories_category_id', 'category_id')
+)
+
+# Row of each paper's abstract embedding in the vector file, see vectorindex.py
+paper_embeddings = Table(
+    'paper_embeddings',
+    Base.metadata,
+    Column('paper_id', String, ForeignKey('papers.id', ondelete='CASCADE'), primary_key=True),
+    Column('row', Integer, nullable=False, unique=True),
+    Column('model', String, nullable=False)
+)
+
+# Published months ('YYYY-MM') whose Parquet partitions are out of date,
+# see export.py; queued_at tells a later change from the one being exported
+export_queue = Table(
+    'export_queue',
+    Base.metadata,
+    Column('month', String, primary_key=True),
+    Column('queued_at', DateTime, nullable=False)
+)
+
+# Corpus statistics maintained by Database.save_papers and delete_paper:
+# ('total', 'papers'|'authors'), ('month', 'YYYY-MM'), ('category', name)
+# and ('authors_per_paper', number of authors) -> count
+paper_stats = Table(
+    'paper_stats',
+    Base.metadata,
+    Column('kind', String, primary_key=True),
+    Column('key', String, primary_key=True),
+    Column('count', Integer, nullable=False)
+)
+
+# Papers cited by a paper according to Semantic Scholar; cited_arxiv_id
+# joins to papers stored here
+paper_references = Table(
+    'paper_references',
+    Base.metadata,
+    Column('paper_id', String, ForeignKey('papers.id', ondelete='CASCADE'), primary_key=True),
+    Column('cited_s2_id', String, primary_key=True),
+    Column('cited_arxiv_id', String),
+    Index('ix_paper_references_cited_arxiv_id', 'cited_arxiv_id')
+)
+
 class Paper(Base):
     __tablename__ = 'papers'
 
     id = Column(String, primary_key=True)
     title = Column(String, nullable=False)
     abstract = Column(String)
-    published = Column(Date)
+    published = Column(Date, index=True)
     updated = Column(Date)
+    # id is the unversioned arXiv id; version is the latest one seen and
+    # content_hash fingerprints the title and abstract that were analyzed
+    version = Column(Integer)
+    content_hash = Column(String)
     llm_analysis = Column(String)
+    # Structured analysis fields; key_findings is a JSON-encoded list of strings
+    main_topic = Column(String)
+    key_findings = Column(String)
+    complexity = Column(String, index=True)
+    # Processing state: 'collected', 'analyzed' or 'failed'. attempts counts
+    # analysis runs; llm_model and prompt_version describe the stored analysis
+    status = Column(String, nullable=False, default='collected', server_default='collected', index=True)
+    attempts = Column(Integer, nullable=False, default=0, server_default='0')
+    llm_model = Column(String)
+    prompt_version = Column(String)
+    llm_error = Column(String)
 
-    # Relationships
-    authors = relationship("Author", back_populates="paper", cascade="all, delete-orphan")
-    categories = relationship("Category", back_populates="paper", cascade="all, delete-orphan")
+    # Relationships (read-only, rows are written by Database.save_papers)
+    authors = relationship("Author", secondary=paper_authors, order_by=paper_authors.c.position,
+                           viewonly=True)
+    categories = relationship("Category", secondary=paper_categories, viewonly=True)
 
 class Author(Base):
     __tablename__ = 'authors'
 
-    id = Column(String, primary_key=True)
-    paper_id = Column(String, ForeignKey('papers.id'))
-    author_name = Column(String, nullable=False)
+    id = Column(Integer, primary_key=True)
+    author_name = Column(String, nullable=False, unique=True)
 
     # Relationship
-    paper = relationship("Paper", back_populates="authors")
+    papers = relationship("Paper", secondary=paper_authors, viewonly=True)
 
 class Category(Base):
     __tablename__ = 'categories'
 
-    id = Column(String, primary_key=True)
-    paper_id = Column(String, ForeignKey('papers.id'))
-    category_name = Column(String, nullable=False)
+    id = Column(Integer, primary_key=True)
+    category_name = Column(String, nullable=False, unique=True)
 
     # Relationship
-    paper = relationship("Paper", back_populates="categories")
+    papers = relationship("Paper", secondary=paper_categories, viewonly=True)
+
+
+class HarvestState(Base):
+    __tablename__ = 'harvest_state'
+
+    # Latest arXiv 'updated' timestamp already stored, per search query
+    query = Column(String, primary_key=True)
+    last_updated = Column(DateTime, nullable=False)
+
+
+class Enrichment(Base):
+    __tablename__ = 'paper_enrichment'
+
+    # Semantic Scholar metadata per paper; found is False for papers
+    # Semantic Scholar does not know, so they are not looked up every run
+    paper_id = Column(String, ForeignKey('papers.id', ondelete='CASCADE'), primary_key=True)
+    found = Column(Boolean, nullable=False)
+    fetched_at = Column(DateTime, nullable=False, index=True)
+    s2_paper_id = Column(String)
+    venue = Column(String)
+    year = Column(Integer)
+    citation_count = Column(Integer, index=True)
+    reference_count = Column(Integer)
+    influential_citation_count = Column(Integer)
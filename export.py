@@ -0,0 +1,196 @@
+import json
+import os
+import shutil
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from config import EXPORT_DIR, EXPORT_DUCKDB_PATH
+from database import Database
+from utils import logger
+
+PAPERS_SCHEMA = pa.schema([
+    ('id', pa.string()),
+    ('title', pa.string()),
+    ('abstract', pa.string()),
+    ('published', pa.date32()),
+    ('updated', pa.date32()),
+    ('version', pa.int32()),
+    ('llm_analysis', pa.string()),
+    ('main_topic', pa.string()),
+    ('key_findings', pa.list_(pa.string())),
+    ('complexity', pa.string()),
+    ('status', pa.string()),
+    ('llm_model', pa.string()),
+    ('prompt_version', pa.string()),
+])
+
+PAPER_AUTHORS_SCHEMA = pa.schema([
+    ('paper_id', pa.string()),
+    ('position', pa.int32()),
+    ('author_name', pa.string()),
+])
+
+PAPER_CATEGORIES_SCHEMA = pa.schema([
+    ('paper_id', pa.string()),
+    ('category_name', pa.string()),
+])
+
+TABLES = {
+    'papers': PAPERS_SCHEMA,
+    'paper_authors': PAPER_AUTHORS_SCHEMA,
+    'paper_categories': PAPER_CATEGORIES_SCHEMA,
+}
+
+PAPER_STATS_SCHEMA = pa.schema([
+    ('kind', pa.string()),
+    ('key', pa.string()),
+    ('count', pa.int64()),
+])
+
+MANIFEST = '_export.json'
+
+
+class ParquetExporter:
+    """
+    Exports papers, their authors and their categories to Parquet for
+    analytical queries, e.g. from the Evidence dashboard.
+
+    Every table is partitioned by published month in hive layout:
+    <export_dir>/<table>/month=YYYY-MM/part-0.parquet. Database.save_papers
+    and delete_paper queue the months they touch, and export() rewrites
+    only those partitions; the first export writes all of them. Papers
+    without a published date are not exported.
+
+    The paper_stats rollup (see Database.get_summary) is small and is
+    rewritten whole as <export_dir>/paper_stats/part-0.parquet.
+    """
+
+    def __init__(self, db: Optional[Database] = None, export_dir: str = EXPORT_DIR,
+                 duckdb_path: Optional[str] = EXPORT_DUCKDB_PATH):
+        self.db = db or Database()
+        self.export_dir = export_dir
+        self.duckdb_path = duckdb_path
+        self.manifest_path = os.path.join(export_dir, MANIFEST)
+
+    def export(self, full: bool = False) -> Dict[str, int]:
+        """Rewrite changed (or, with full, all) partitions; returns the number of months and papers written"""
+        queue = self.db.get_export_queue()
+        manifest = self._read_manifest()
+        if full or manifest is None:
+            # Months exported before but now without papers are removed too
+            previous = manifest['partitions'] if manifest else {}
+            manifest = {'partitions': {}}
+            months = set(self.db.get_published_months()) | set(queue) | set(previous)
+        else:
+            months = set(queue)
+
+        written = 0
+        for month in sorted(months):
+            count = self._export_month(month)
+            if count:
+                manifest['partitions'][month] = count
+            else:
+                manifest['partitions'].pop(month, None)
+            written += count
+
+        self._export_stats()
+        manifest['exported_at'] = datetime.utcnow().isoformat()
+        self._write_manifest(manifest)
+        # Only after the partitions are in place, so a failed export is retried
+        self.db.clear_export_queue(queue)
+        logger.info(f"Exported {written} papers in {len(months)} monthly partitions to {self.export_dir}")
+
+        if self.duckdb_path:
+            register_duckdb(self.export_dir, self.duckdb_path)
+        return {'months': len(months), 'papers': written}
+
+    def _export_month(self, month: str) -> int:
+        first = date.fromisoformat(f"{month}-01")
+        last = (first + timedelta(days=31)).replace(day=1) - timedelta(days=1)
+        rows = {name: [] for name in TABLES}
+        for paper in self.db.iter_papers(published_from=first, published_to=last):
+            rows['papers'].append({
+                **{field: paper.get(field) for field in PAPERS_SCHEMA.names},
+                'published': date.fromisoformat(paper['published']),
+                'updated': date.fromisoformat(paper['updated']) if paper['updated'] else None,
+            })
+            rows['paper_authors'].extend(
+                {'paper_id': paper['id'], 'position': position, 'author_name': name}
+                for position, name in enumerate(paper['authors'])
+            )
+            rows['paper_categories'].extend(
+                {'paper_id': paper['id'], 'category_name': name} for name in paper['categories']
+            )
+
+        for name, schema in TABLES.items():
+            partition = os.path.join(self.export_dir, name, f"month={month}")
+            if rows['papers']:
+                self._write_partition(partition, pa.Table.from_pylist(rows[name], schema=schema))
+            elif os.path.isdir(partition):
+                shutil.rmtree(partition)
+        return len(rows['papers'])
+
+    def _export_stats(self):
+        summary = self.db.get_summary()
+        rows = [
+            {'kind': 'total', 'key': 'papers', 'count': summary['total_papers']},
+            {'kind': 'total', 'key': 'authors', 'count': summary['unique_authors']},
+        ]
+        for kind, counts in (('month', summary['papers_per_month']),
+                             ('category', summary['papers_per_category']),
+                             ('authors_per_paper', summary['authors_per_paper'])):
+            rows.extend({'kind': kind, 'key': str(key), 'count': count} for key, count in counts.items())
+        self._write_partition(os.path.join(self.export_dir, 'paper_stats'),
+                              pa.Table.from_pylist(rows, schema=PAPER_STATS_SCHEMA))
+
+    @staticmethod
+    def _write_partition(partition: str, table: pa.Table):
+        # Readers see either the old or the new file, never a partial one
+        os.makedirs(partition, exist_ok=True)
+        path = os.path.join(partition, 'part-0.parquet')
+        pq.write_table(table, path + '.tmp', compression='zstd')
+        os.replace(path + '.tmp', path)
+
+    def _read_manifest(self) -> Optional[Dict]:
+        if not os.path.exists(self.manifest_path):
+            return None
+        with open(self.manifest_path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def _write_manifest(self, manifest: Dict):
+        os.makedirs(self.export_dir, exist_ok=True)
+        with open(self.manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(self.manifest_path + '.tmp', self.manifest_path)
+
+
+def register_duckdb(export_dir: str, duckdb_path: str,
+                    tables: Iterable[str] = (*TABLES, 'paper_stats')) -> List[str]:
+    """
+    Create or replace a view per exported table in the DuckDB file at
+    duckdb_path. Views read the Parquet files at query time, so they only
+    need registering once; month is a column taken from the partition path
+    of partitioned tables.
+    """
+    try:
+        import duckdb
+    except ImportError:
+        raise ImportError("Registering the export in DuckDB requires duckdb: pip install duckdb")
+
+    registered = []
+    with duckdb.connect(duckdb_path) as conn:
+        for name in tables:
+            directory = os.path.abspath(os.path.join(export_dir, name))
+            if not os.path.isdir(directory) or not os.listdir(directory):
+                continue
+            pattern = os.path.join(directory, '**', '*.parquet').replace("'", "''")
+            conn.execute(
+                f"CREATE OR REPLACE VIEW {name} AS "
+                f"SELECT * FROM read_parquet('{pattern}', hive_partitioning = true)"
+            )
+            registered.append(name)
+    logger.info(f"Registered {registered} in {duckdb_path}")
+    return registered
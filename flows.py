@@ -1,37 +1,171 @@
 from prefect import flow, task
 from arxiv_scrap import ArxivCollector
-from preproc import LLMProcessor
+from preproc import EmbeddingProcessor, PROMPT_VERSION
+from pipeline import MODEL_NAME, Skipped, analyze_and_save, stream_and_save, save_batch, summarize
 from database import Database
+from semantic_scrap import SemanticScholarClient
+from export import ParquetExporter
+from config import START_DATE, LLM_MAX_CONCURRENCY, DB_FLUSH_SIZE, EMBEDDING_BATCH_SIZE, S2_BATCH_SIZE, \
+    EXPORT_DIR, EXPORT_DUCKDB_PATH
+from metrics import PIPELINE_STAGE_DURATION
+
+
+def _harvest_since(query, incremental):
+    if not incremental:
+        return None
+    # Only fetch papers newer than what is already stored for this query
+    return Database().get_watermark(query) or START_DATE
+
+
+@task
+def collect_papers(max_papers, query, incremental=True):
+    collector = ArxivCollector(query=query)
+    since = _harvest_since(query, incremental)
+    with PIPELINE_STAGE_DURATION.time(stage="collect"):
+        return collector.collect_papers(max_results=max_papers, since=since, is_stored=Database().has_paper)
+
+
+@task
+def process_papers(papers, max_workers=LLM_MAX_CONCURRENCY, flush_size=DB_FLUSH_SIZE):
+    # Analyses are saved as they complete instead of after the whole run
+    processed = []
+    with PIPELINE_STAGE_DURATION.time(stage="llm"):
+        for batch in analyze_and_save(papers, Database(), max_workers=max_workers, flush_size=flush_size):
+            processed.extend(batch)
+    return processed
+
+
+@task
+def save_to_database(papers, query):
+    """Save new and changed papers as collected and return them; unchanged ones need no analysis"""
+    db = Database()
+    changed = db.filter_changed(papers)
+    if changed:
+        save_batch(db, changed)
+    db.update_watermark(query, papers)
+    return changed
 
 
 @task
-def collect_papers(max_papers):
-    collector = ArxivCollector()
-    return collector.collect_papers(max_results=max_papers)
+def stream_papers(max_papers, query, incremental=True, max_workers=LLM_MAX_CONCURRENCY,
+                  flush_size=DB_FLUSH_SIZE):
+    """
+    Collect, analyze and save papers as one stream.
+
+    Papers go to the LLM as their arXiv page arrives and are written every
+    flush_size analyzed papers, so memory is bounded by the page size, the
+    processor's pending window and flush_size rather than max_papers.
+    Results come out in collection order, so the watermark can be advanced
+    after every flush. Papers whose text is unchanged since their last
+    analysis are skipped before the LLM.
+    """
+    db = Database()
+    collector = ArxivCollector(query=query)
+    papers = collector.iter_papers(max_results=max_papers, since=_harvest_since(query, incremental),
+                                   is_stored=db.has_paper)
+    skipped = Skipped()
+    with PIPELINE_STAGE_DURATION.time(stage="stream"):
+        summary = summarize(stream_and_save(papers, db, query, skipped,
+                                            max_workers=max_workers, flush_size=flush_size))
+    summary['skipped_papers'] = len(skipped)
+    return summary
 
 
 @task
-def process_papers(papers):
-    processor = LLMProcessor("ollama/qwen2.5-coder:latest")
-    return [processor.process_paper(paper) for paper in papers]
+def resume_papers(reanalyze=False, limit=None, max_workers=LLM_MAX_CONCURRENCY, flush_size=DB_FLUSH_SIZE):
+    """
+    Analyze stored papers that are not analyzed yet or whose last attempt
+    failed. With reanalyze, also papers analyzed by another model or with
+    an older prompt version.
+    """
+    db = Database()
+    papers = db.iter_papers_to_analyze(
+        model_name=MODEL_NAME if reanalyze else None,
+        prompt_version=PROMPT_VERSION if reanalyze else None,
+        limit=limit
+    )
+    with PIPELINE_STAGE_DURATION.time(stage="stream"):
+        return summarize(analyze_and_save(papers, db, max_workers=max_workers, flush_size=flush_size))
+
 
+@task
+def embed_papers(limit=None, batch_size=EMBEDDING_BATCH_SIZE):
+    """Embed the abstracts of stored papers that have no embedding from the current model"""
+    db = Database()
+    embedded = 0
+    with EmbeddingProcessor() as processor, PIPELINE_STAGE_DURATION.time(stage="embed"):
+        papers = db.iter_papers_without_embedding(processor.model_name, limit=limit)
+        for embeddings in processor.embed_papers(papers, batch_size):
+            db.save_embeddings(embeddings, processor.model_name)
+            embedded += len(embeddings)
+    db.vectors.save()
+    return embedded
 
 
 @task
-def save_to_database(papers):
+def enrich_papers(limit=None, batch_size=S2_BATCH_SIZE):
+    """Resolve citation counts, venue and references of stored papers via Semantic Scholar"""
     db = Database()
-    db.save_papers(papers)
+    client = SemanticScholarClient()
+    summary = {'total_papers': 0, 'found_papers': 0}
+    with PIPELINE_STAGE_DURATION.time(stage="enrich"):
+        for records in client.enrich_papers(db.iter_ids_to_enrich(limit=limit), batch_size):
+            db.save_enrichment(records)
+            summary['total_papers'] += len(records)
+            summary['found_papers'] += sum(1 for record in records if record['found'])
+    return summary
+
+
+@task
+def export_papers(full=False, export_dir=EXPORT_DIR, duckdb_path=EXPORT_DUCKDB_PATH):
+    """Rewrite the Parquet partitions of months changed since the last export"""
+    exporter = ParquetExporter(export_dir=export_dir, duckdb_path=duckdb_path)
+    with PIPELINE_STAGE_DURATION.time(stage="export"):
+        return exporter.export(full=full)
 
 
 @flow
-def arxiv_analysis_flow(max_papers):
+def arxiv_analysis_flow(max_papers, query="Deep learning", incremental=True,
+                        max_workers=LLM_MAX_CONCURRENCY):
     # Collect papers
-    papers = collect_papers(max_papers)
+    papers = collect_papers(max_papers, query, incremental)
 
-    # Process with LLM
-    processed_papers = process_papers(papers)
+    # Save new and changed ones as collected, so an interrupted run can be resumed
+    papers = save_to_database(papers, query)
 
-    # Save to database
-    save_to_database(processed_papers)
+    # Process with LLM, saving analyses as they complete
+    processed_papers = process_papers(papers, max_workers)
 
     return processed_papers
+
+
+@flow
+def arxiv_streaming_flow(max_papers, query="Deep learning", incremental=True,
+                         max_workers=LLM_MAX_CONCURRENCY, flush_size=DB_FLUSH_SIZE):
+    # Collect, process and save in micro-batches
+    return stream_papers(max_papers, query, incremental, max_workers, flush_size)
+
+
+@flow
+def arxiv_resume_flow(reanalyze=False, limit=None, max_workers=LLM_MAX_CONCURRENCY,
+                      flush_size=DB_FLUSH_SIZE):
+    # Analyze papers left unanalyzed or failed by earlier runs
+    return resume_papers(reanalyze, limit, max_workers, flush_size)
+
+
+@flow
+def arxiv_embedding_flow(limit=None, batch_size=EMBEDDING_BATCH_SIZE):
+    # Incrementally embed papers for Database.similar
+    return embed_papers(limit, batch_size)
+
+
+@flow
+def arxiv_enrichment_flow(limit=None, batch_size=S2_BATCH_SIZE):
+    # Enrich stored papers that were never or not recently looked up
+    return enrich_papers(limit, batch_size)
+
+
+@flow
+def arxiv_export_flow(full=False, export_dir=EXPORT_DIR, duckdb_path=EXPORT_DUCKDB_PATH):
+    # Columnar copy of the saved papers for the dashboard
+    return export_papers(full, export_dir, duckdb_path)
@@ -0,0 +1,138 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Optional, Dict, Any
+
+from loguru import logger
+
+
+class ResponseCache:
+    """Дисковый кэш ответов LLM в SQLite с адресацией по хэшу содержимого"""
+
+    # Как часто (в записях) проверять лимит размера кэша
+    EVICT_EVERY = 100
+
+    def __init__(self,
+                 path: str,
+                 ttl_seconds: Optional[float] = None,
+                 max_entries: Optional[int] = None):
+        """
+        Инициализация кэша
+
+        Args:
+            path (str): Путь к файлу SQLite
+            ttl_seconds (Optional[float]): Время жизни записи, None - без ограничения
+            max_entries (Optional[int]): Максимальное число записей, None - без ограничения
+        """
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_responses_accessed_at ON responses (accessed_at)"
+        )
+        self._conn.commit()
+        self.evict()
+
+    @staticmethod
+    def make_key(model_name: str, prompt: str, parameters: Dict[str, Any]) -> str:
+        """Строит ключ кэша как SHA-256 от модели, промпта и параметров генерации"""
+        payload = json.dumps(
+            {"model": model_name, "prompt": prompt, "parameters": parameters},
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Возвращает сохраненный ответ или None, если записи нет или она устарела"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            response, created_at = row
+            if self.ttl_seconds is not None and now - created_at > self.ttl_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+
+            self._conn.execute(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+            return response
+
+    def set(self, key: str, response: str):
+        """Сохраняет ответ в кэш"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, response, now, now)
+            )
+            self._conn.commit()
+            self._writes += 1
+            should_evict = self._writes % self.EVICT_EVERY == 0
+
+        if should_evict:
+            self.evict()
+
+    def delete(self, key: str):
+        """Удаляет запись из кэша"""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def evict(self):
+        """Удаляет устаревшие записи и самые давно использованные сверх лимита"""
+        with self._lock:
+            if self.ttl_seconds is not None:
+                self._conn.execute(
+                    "DELETE FROM responses WHERE created_at < ?",
+                    (time.time() - self.ttl_seconds,)
+                )
+            if self.max_entries is not None:
+                count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+                excess = count - self.max_entries
+                if excess > 0:
+                    logger.debug(f"Evicting {excess} entries from LLM cache")
+                    self._conn.execute(
+                        "DELETE FROM responses WHERE key IN "
+                        "(SELECT key FROM responses ORDER BY accessed_at LIMIT ?)",
+                        (excess,)
+                    )
+            self._conn.commit()
+
+    def clear(self):
+        """Очищает кэш"""
+        logger.info(f"Clearing LLM cache: {self.path}")
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def close(self):
+        """Закрывает соединение с базой кэша"""
+        with self._lock:
+            self._conn.close()
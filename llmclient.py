@@ -4,10 +4,27 @@ from enum import Enum
 import re
 from loguru import logger
 import sys
+import asyncio
+import threading
+import time
+import weakref
+from collections import Counter, deque
 from datetime import datetime
-import requests
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple, Iterator, List
 import json
+import httpx
+from llmcache import ResponseCache
+from config import (
+    LLM_CACHE_PATH, LLM_CACHE_TTL, LLM_CACHE_MAX_ENTRIES,
+    LLM_HISTORY_SIZE, LLM_HISTORY_FILE,
+    LLM_PROVIDER_CONCURRENCY, LLM_TOKENS_PER_MINUTE, OLLAMA_BASE_URL,
+    HTTP_POOL_SIZE, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_KEEPALIVE_EXPIRY
+)
+from utils import get_http_session, is_connection_error
+from metrics import (
+    LLM_REQUEST_DURATION, LLM_REQUEST_ERRORS, LLM_TOKENS_GENERATED,
+    LLM_REQUESTS_IN_FLIGHT, LLM_CACHE_LOOKUPS
+)
 
 # Настройка логирования
 logger.remove()
@@ -30,21 +47,140 @@ class ModelProvider(Enum):
     UNKNOWN = "unknown"
 
 
+class TokenRateLimiter:
+    """Ограничитель токенов в минуту для асинхронных запросов (token bucket)"""
+
+    def __init__(self, tokens_per_minute: int):
+        """
+        Args:
+            tokens_per_minute (int): Допустимое число токенов в минуту
+        """
+        self.capacity = tokens_per_minute
+        self.rate = tokens_per_minute / 60.0
+        self.tokens = float(tokens_per_minute)
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: int):
+        """Ждет, пока в бюджете не освободится нужное число токенов"""
+        tokens = min(tokens, self.capacity)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+
+class RequestAggregates:
+    """Накопительная статистика запросов: O(1) на добавление и на чтение"""
+
+    METRICS = ("time_to_first_token", "tokens_per_second")
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Сбрасывает все агрегаты"""
+        self.count = 0
+        self.total_duration = 0.0
+        self.total_prompt_length = 0
+        self.total_tokens_generated = 0
+        self.first_timestamp = None
+        self.last_timestamp = None
+        self.temperatures = Counter()
+        self.metric_sums = {name: 0.0 for name in self.METRICS}
+        self.metric_counts = {name: 0 for name in self.METRICS}
+
+    def add(self, request: Dict[str, Any]):
+        """Учитывает запрос в агрегатах"""
+        self.count += 1
+        self.total_duration += request["duration"]
+        self.total_prompt_length += len(request["prompt"])
+        self.total_tokens_generated += request.get("tokens_generated", 0)
+        if self.first_timestamp is None:
+            self.first_timestamp = request["timestamp"]
+        self.last_timestamp = request["timestamp"]
+        self.temperatures[request["parameters"]["temperature"]] += 1
+        for name in self.METRICS:
+            if name in request:
+                self.metric_sums[name] += request[name]
+                self.metric_counts[name] += 1
+
+    def average(self, name: str) -> Optional[float]:
+        """Среднее значение метрики по запросам, где она была записана"""
+        if not self.metric_counts[name]:
+            return None
+        return self.metric_sums[name] / self.metric_counts[name]
+
+
+# Лимиты провайдеров общие для всех моделей, но свои для каждого event loop
+_provider_limits = weakref.WeakKeyDictionary()
+
+
+def _get_provider_limits(provider: ModelProvider) -> Tuple[asyncio.Semaphore, Optional[TokenRateLimiter]]:
+    """Возвращает семафор и ограничитель токенов провайдера для текущего event loop"""
+    loop_limits = _provider_limits.setdefault(asyncio.get_running_loop(), {})
+    if provider not in loop_limits:
+        tokens_per_minute = LLM_TOKENS_PER_MINUTE.get(provider.value)
+        loop_limits[provider] = (
+            asyncio.Semaphore(LLM_PROVIDER_CONCURRENCY.get(provider.value, 1)),
+            TokenRateLimiter(tokens_per_minute) if tokens_per_minute else None
+        )
+    return loop_limits[provider]
+
+
 class LLMModel:
-    def __init__(self, model_name: str, api_key: Optional[str] = None):
+    def __init__(self,
+                 model_name: str,
+                 api_key: Optional[str] = None,
+                 use_cache: bool = True,
+                 cache: Optional[ResponseCache] = None,
+                 session: Optional[Any] = None,
+                 history_size: Optional[int] = LLM_HISTORY_SIZE,
+                 history_file: Optional[str] = LLM_HISTORY_FILE,
+                 base_url: Optional[str] = None):
         """
         Инициализация модели LLM
 
         Args:
             model_name (str): Название модели
             api_key (Optional[str]): API ключ для доступа к модели
+            use_cache (bool): Использовать ли дисковый кэш ответов
+            cache (Optional[ResponseCache]): Готовый кэш, по умолчанию создается из config
+            session (Optional[Any]): HTTP-сессия с пулом соединений, по умолчанию общая для процесса
+            history_size (Optional[int]): Сколько последних запросов хранить в памяти, None - все
+            history_file (Optional[str]): JSONL-файл, куда дописывается каждый завершенный запрос
+            base_url (Optional[str]): Адрес сервера Ollama, по умолчанию OLLAMA_BASE_URL
         """
         logger.info(f"Initializing LLM model: {model_name}")
         self.model_name = model_name
         self.api_key = api_key
+        self.base_url = base_url
         self.provider = self._parse_provider()
         self.client = self._initialize_client()
-        self.request_history = []
+        # Кольцевой буфер последних запросов и статистика по всем запросам
+        self.request_history = deque(maxlen=history_size)
+        self._aggregates = RequestAggregates()
+        self._history_lock = threading.Lock()
+        self._history_sink = open(history_file, 'a', encoding='utf-8') if history_file else None
+        self.session = session or get_http_session()
+        self.cache = None
+        # Закрываем при close() только кэш, созданный самой моделью
+        self._owns_cache = use_cache and cache is None
+        if use_cache:
+            self.cache = cache or ResponseCache(
+                LLM_CACHE_PATH,
+                ttl_seconds=LLM_CACHE_TTL,
+                max_entries=LLM_CACHE_MAX_ENTRIES
+            )
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # Асинхронные клиенты привязаны к event loop, в котором созданы
+        self._async_clients = weakref.WeakKeyDictionary()
 
     def _parse_provider(self) -> ModelProvider:
         """Определяет провайдера модели на основе имени"""
@@ -52,8 +188,10 @@ class LLMModel:
 
         logger.debug(f"Parsing provider for model: {self.model_name}")
 
-        if any(name in model_name_lower for name in ["gpt", "text-davinci", "openai"]):
+        if any(name in model_name_lower for name in ["gpt", "text-davinci", "text-embedding", "openai"]):
             logger.info("Detected OpenAI provider")
+            # API принимает имя модели без префикса провайдера
+            self.model_name = self.model_name.replace("openai/", "")
             return ModelProvider.OPENAI
         elif any(name in model_name_lower for name in ["claude", "anthropic"]):
             logger.info("Detected Anthropic provider")
@@ -87,7 +225,7 @@ class LLMModel:
                 pass
             elif self.provider == ModelProvider.OLLAMA:
                 # Реализация для Ollama
-                return "http://localhost:11434"  # Стандартный URL для Ollama
+                return self.base_url or OLLAMA_BASE_URL
             else:
                 logger.error(f"Unsupported model provider: {self.provider}")
                 raise ValueError(f"Unsupported model provider: {self.provider}")
@@ -99,6 +237,7 @@ class LLMModel:
                  prompt: str,
                  max_tokens: int = 1000,
                  temperature: float = 0.7,
+                 use_cache: bool = True,
                  **kwargs) -> str:
         """
         Генерирует ответ на основе промпта
@@ -107,7 +246,8 @@ class LLMModel:
             prompt (str): Входной текст
             max_tokens (int): Максимальное количество токенов в ответе
             temperature (float): Температура генерации
-            **kwargs: Дополнительные параметры
+            use_cache (bool): False - обойти кэш и всегда обращаться к модели
+            **kwargs: Дополнительные параметры (json_mode=True - ответ строго в формате JSON)
 
         Returns:
             str: Сгенерированный текст
@@ -115,47 +255,309 @@ class LLMModel:
         start_time = datetime.now()
         logger.info(f"Generating response for prompt: {prompt[:100]}...")
 
+        cache_key, cached = self._lookup_cache(prompt, max_tokens, temperature, use_cache, kwargs)
+        if cached is not None:
+            return cached
+
+        stats = {}
+        LLM_REQUESTS_IN_FLIGHT.inc(provider=self.provider.value)
         try:
             if self.provider == ModelProvider.OPENAI:
-                response = self._generate_openai(prompt, max_tokens, temperature, **kwargs)
+                response = self._generate_openai(prompt, max_tokens, temperature, stats=stats, **kwargs)
             elif self.provider == ModelProvider.ANTHROPIC:
                 response = self._generate_anthropic(prompt, max_tokens, temperature, **kwargs)
             elif self.provider == ModelProvider.OLLAMA:
-                response = self._generate_ollama(prompt, max_tokens, temperature, **kwargs)
+                response = self._generate_ollama(prompt, max_tokens, temperature, stats=stats, **kwargs)
             else:
                 logger.error(f"Unsupported provider: {self.provider}")
                 raise ValueError(f"Unsupported provider: {self.provider}")
 
-            end_time = datetime.now()
-            duration = (end_time - start_time).total_seconds()
-
-            # Сохраняем информацию о запросе
-            request_info = {
-                "timestamp": start_time,
-                "duration": duration,
-                "prompt": prompt,
-                "response": response,
-                "parameters": {
-                    "max_tokens": max_tokens,
-                    "temperature": temperature,
-                    **kwargs
-                }
-            }
-            self.request_history.append(request_info)
+            self._record_request(start_time, prompt, response, max_tokens, temperature, kwargs, cache_key, stats)
+            return response
 
-            logger.info(f"Generated response in {duration:.2f} seconds")
-            logger.debug(f"Response: {response[:100]}...")
+        except Exception as e:
+            LLM_REQUEST_ERRORS.inc(provider=self.provider.value, model=self.model_name)
+            logger.error(f"Error generating response: {str(e)}", exc_info=True)
+            raise
+        finally:
+            LLM_REQUESTS_IN_FLIGHT.dec(provider=self.provider.value)
+
+    async def agenerate(self,
+                        prompt: str,
+                        max_tokens: int = 1000,
+                        temperature: float = 0.7,
+                        use_cache: bool = True,
+                        **kwargs) -> str:
+        """
+        Асинхронно генерирует ответ на основе промпта
+
+        Число одновременных запросов и токенов в минуту ограничивается
+        на уровне провайдера (LLM_PROVIDER_CONCURRENCY, LLM_TOKENS_PER_MINUTE).
+
+        Args:
+            prompt (str): Входной текст
+            max_tokens (int): Максимальное количество токенов в ответе
+            temperature (float): Температура генерации
+            use_cache (bool): False - обойти кэш и всегда обращаться к модели
+            **kwargs: Дополнительные параметры (json_mode=True - ответ строго в формате JSON)
 
+        Returns:
+            str: Сгенерированный текст
+        """
+        logger.info(f"Generating async response for prompt: {prompt[:100]}...")
+
+        cache_key, cached = self._lookup_cache(prompt, max_tokens, temperature, use_cache, kwargs)
+        if cached is not None:
+            return cached
+
+        semaphore, rate_limiter = _get_provider_limits(self.provider)
+        try:
+            async with semaphore:
+                if rate_limiter is not None:
+                    # Грубая оценка: ~4 символа на токен плюс резерв под ответ
+                    await rate_limiter.acquire(len(prompt) // 4 + max_tokens)
+
+                start_time = datetime.now()
+                stats = {}
+                LLM_REQUESTS_IN_FLIGHT.inc(provider=self.provider.value)
+                try:
+                    if self.provider == ModelProvider.OPENAI:
+                        response = await self._agenerate_openai(prompt, max_tokens, temperature, stats=stats, **kwargs)
+                    elif self.provider == ModelProvider.OLLAMA:
+                        response = await self._agenerate_ollama(prompt, max_tokens, temperature, stats=stats, **kwargs)
+                    else:
+                        logger.error(f"Unsupported provider for async generation: {self.provider}")
+                        raise ValueError(f"Unsupported provider for async generation: {self.provider}")
+                finally:
+                    LLM_REQUESTS_IN_FLIGHT.dec(provider=self.provider.value)
+
+            self._record_request(start_time, prompt, response, max_tokens, temperature, kwargs, cache_key, stats)
             return response
 
         except Exception as e:
-            logger.error(f"Error generating response: {str(e)}", exc_info=True)
+            LLM_REQUEST_ERRORS.inc(provider=self.provider.value, model=self.model_name)
+            logger.error(f"Error generating async response: {str(e)}", exc_info=True)
             raise
 
+    def generate_stream(self,
+                        prompt: str,
+                        max_tokens: int = 1000,
+                        temperature: float = 0.7,
+                        use_cache: bool = True,
+                        **kwargs) -> Iterator[str]:
+        """
+        Генерирует ответ по частям, отдавая фрагменты текста по мере поступления
+
+        Время до первого токена и скорость генерации сохраняются в историю
+        запросов после завершения потока.
+
+        Args:
+            prompt (str): Входной текст
+            max_tokens (int): Максимальное количество токенов в ответе
+            temperature (float): Температура генерации
+            use_cache (bool): False - обойти кэш и всегда обращаться к модели
+            **kwargs: Дополнительные параметры (json_mode=True - ответ строго в формате JSON)
+
+        Yields:
+            str: Очередной фрагмент сгенерированного текста
+        """
+        start_time = datetime.now()
+        logger.info(f"Streaming response for prompt: {prompt[:100]}...")
+
+        cache_key, cached = self._lookup_cache(prompt, max_tokens, temperature, use_cache, kwargs)
+        if cached is not None:
+            yield cached
+            return
+
+        if self.provider == ModelProvider.OPENAI:
+            chunks = self._stream_openai(prompt, max_tokens, temperature, **kwargs)
+        elif self.provider == ModelProvider.OLLAMA:
+            chunks = self._stream_ollama(prompt, max_tokens, temperature, **kwargs)
+        else:
+            logger.error(f"Unsupported provider for streaming: {self.provider}")
+            raise ValueError(f"Unsupported provider for streaming: {self.provider}")
+
+        parts = []
+        stats = {}
+        LLM_REQUESTS_IN_FLIGHT.inc(provider=self.provider.value)
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, dict):
+                    # Итоговая статистика генерации от провайдера
+                    stats.update(chunk)
+                    continue
+                if not parts:
+                    stats["time_to_first_token"] = (datetime.now() - start_time).total_seconds()
+                parts.append(chunk)
+                yield chunk
+        except Exception as e:
+            LLM_REQUEST_ERRORS.inc(provider=self.provider.value, model=self.model_name)
+            logger.error(f"Error streaming response: {str(e)}", exc_info=True)
+            raise
+        finally:
+            # Также при досрочном закрытии генератора потребителем
+            LLM_REQUESTS_IN_FLIGHT.dec(provider=self.provider.value)
+
+        if "tokens_per_second" not in stats and stats.get("tokens_generated") and parts:
+            # Провайдер не сообщил длительность генерации - считаем от первого токена
+            generation_time = (datetime.now() - start_time).total_seconds() - stats["time_to_first_token"]
+            if generation_time > 0:
+                stats["tokens_per_second"] = stats["tokens_generated"] / generation_time
+
+        self._record_request(start_time, prompt, "".join(parts), max_tokens, temperature, kwargs, cache_key, stats)
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """
+        Вычисляет эмбеддинги текстов одним запросом
+
+        Ответы не кэшируются и не попадают в историю запросов.
+
+        Args:
+            texts (List[str]): Тексты
+
+        Returns:
+            List[List[float]]: По одному вектору на текст, в порядке texts
+        """
+        if not texts:
+            return []
+        logger.debug(f"Embedding {len(texts)} texts with {self.model_name}")
+
+        started = time.perf_counter()
+        try:
+            if self.provider == ModelProvider.OPENAI:
+                vectors = self._embed_openai(texts)
+            elif self.provider == ModelProvider.OLLAMA:
+                vectors = self._embed_ollama(texts)
+            else:
+                logger.error(f"Unsupported provider for embeddings: {self.provider}")
+                raise ValueError(f"Unsupported provider for embeddings: {self.provider}")
+        except Exception as e:
+            LLM_REQUEST_ERRORS.inc(provider=self.provider.value, model=self.model_name)
+            logger.error(f"Error computing embeddings: {str(e)}", exc_info=True)
+            raise
+
+        LLM_REQUEST_DURATION.observe(time.perf_counter() - started,
+                                     provider=self.provider.value, model=self.model_name)
+        if len(vectors) != len(texts):
+            raise ValueError(f"Expected {len(texts)} embeddings, got {len(vectors)}")
+        return vectors
+
+    def _lookup_cache(self,
+                      prompt: str,
+                      max_tokens: int,
+                      temperature: float,
+                      use_cache: bool,
+                      kwargs: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
+        """Возвращает ключ кэша и сохраненный ответ, если он есть"""
+        if self.cache is None or not use_cache:
+            return None, None
+
+        cache_key = self._cache_key(prompt, max_tokens, temperature, kwargs)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            self.cache_hits += 1
+            LLM_CACHE_LOOKUPS.inc(result="hit")
+            logger.info("Returning cached response")
+            return cache_key, cached
+        self.cache_misses += 1
+        LLM_CACHE_LOOKUPS.inc(result="miss")
+        return cache_key, None
+
+    def forget_cached_response(self,
+                               prompt: str,
+                               max_tokens: int = 1000,
+                               temperature: float = 0.7,
+                               **kwargs):
+        """
+        Удаляет из кэша ответ на промпт, например если он оказался некорректным
+
+        Параметры должны совпадать с переданными в generate.
+        """
+        if self.cache is None:
+            return
+        self.cache.delete(self._cache_key(prompt, max_tokens, temperature, kwargs))
+
+    def _cache_key(self, prompt: str, max_tokens: int, temperature: float, kwargs: Dict[str, Any]) -> str:
+        """Строит ключ кэша для запроса"""
+        return ResponseCache.make_key(
+            f"{self.provider.value}/{self.model_name}",
+            prompt,
+            {"max_tokens": max_tokens, "temperature": temperature, **kwargs}
+        )
+
+    def _record_request(self,
+                        start_time: datetime,
+                        prompt: str,
+                        response: str,
+                        max_tokens: int,
+                        temperature: float,
+                        kwargs: Dict[str, Any],
+                        cache_key: Optional[str],
+                        stats: Optional[Dict[str, Any]] = None):
+        """Сохраняет информацию о запросе в историю и ответ в кэш"""
+        duration = (datetime.now() - start_time).total_seconds()
+
+        request_info = {
+            "timestamp": start_time,
+            "duration": duration,
+            "prompt": prompt,
+            "response": response,
+            "parameters": {
+                "max_tokens": max_tokens,
+                "temperature": temperature,
+                **kwargs
+            },
+            # Метрики генерации: time_to_first_token, tokens_generated, tokens_per_second
+            **(stats or {})
+        }
+        LLM_REQUEST_DURATION.observe(duration, provider=self.provider.value, model=self.model_name)
+        if request_info.get("tokens_generated"):
+            LLM_TOKENS_GENERATED.inc(request_info["tokens_generated"],
+                                     provider=self.provider.value, model=self.model_name)
+
+        with self._history_lock:
+            self.request_history.append(request_info)
+            self._aggregates.add(request_info)
+            if self._history_sink is not None:
+                self._history_sink.write(json.dumps(self._serialize_request(request_info), ensure_ascii=False) + "\n")
+                self._history_sink.flush()
+
+        if cache_key is not None:
+            self.cache.set(cache_key, response)
+
+        logger.info(f"Generated response in {duration:.2f} seconds")
+        logger.debug(f"Response: {response[:100]}...")
+
+    def _get_async_client(self) -> Any:
+        """Возвращает асинхронный клиент провайдера для текущего event loop"""
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            if self.provider == ModelProvider.OPENAI:
+                client = openai.AsyncOpenAI(api_key=self.api_key)
+            else:
+                client = httpx.AsyncClient(
+                    timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+                    limits=httpx.Limits(
+                        max_connections=HTTP_POOL_SIZE,
+                        max_keepalive_connections=HTTP_POOL_SIZE,
+                        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+                    )
+                )
+            self._async_clients[loop] = client
+        return client
+
+    async def aclose(self):
+        """Закрывает асинхронный клиент текущего event loop"""
+        client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.close() if isinstance(client, openai.AsyncOpenAI) else await client.aclose()
+
     def _generate_openai(self,
                          prompt: str,
                          max_tokens: int,
                          temperature: float,
+                         stats: Optional[Dict[str, Any]] = None,
                          **kwargs) -> str:
         """Генерация текста с помощью OpenAI API"""
         logger.debug("Sending request to OpenAI API")
@@ -166,13 +568,79 @@ class LLMModel:
                 messages=[{"role": "user", "content": prompt}],
                 max_tokens=max_tokens,
                 temperature=temperature,
-                **kwargs
+                **self._openai_options(kwargs)
             )
+            if stats is not None and response.usage:
+                stats["tokens_generated"] = response.usage.completion_tokens
             return response.choices[0].message.content
         except Exception as e:
             logger.error(f"OpenAI API error: {str(e)}")
             raise
 
+    def _stream_openai(self,
+                       prompt: str,
+                       max_tokens: int,
+                       temperature: float,
+                       **kwargs) -> Iterator[Any]:
+        """Потоковая генерация текста с помощью OpenAI API"""
+        logger.debug("Sending streaming request to OpenAI API")
+
+        try:
+            stream = self.client.chat.completions.create(
+                model=self.model_name,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stream=True,
+                stream_options={"include_usage": True},
+                **self._openai_options(kwargs)
+            )
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+                if chunk.usage:
+                    yield {"tokens_generated": chunk.usage.completion_tokens}
+        except Exception as e:
+            logger.error(f"OpenAI API error: {str(e)}")
+            raise
+
+    async def _agenerate_openai(self,
+                                prompt: str,
+                                max_tokens: int,
+                                temperature: float,
+                                stats: Optional[Dict[str, Any]] = None,
+                                **kwargs) -> str:
+        """Асинхронная генерация текста с помощью OpenAI API"""
+        logger.debug("Sending async request to OpenAI API")
+
+        try:
+            response = await self._get_async_client().chat.completions.create(
+                model=self.model_name,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=max_tokens,
+                temperature=temperature,
+                **self._openai_options(kwargs)
+            )
+            if stats is not None and response.usage:
+                stats["tokens_generated"] = response.usage.completion_tokens
+            return response.choices[0].message.content
+        except Exception as e:
+            logger.error(f"OpenAI API error: {str(e)}")
+            raise
+
+    @staticmethod
+    def _openai_options(kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """Переводит общие параметры генерации в параметры OpenAI API"""
+        options = dict(kwargs)
+        if options.pop("json_mode", False):
+            options["response_format"] = {"type": "json_object"}
+        return options
+
+    def _embed_openai(self, texts: List[str]) -> List[List[float]]:
+        """Эмбеддинги с помощью OpenAI API"""
+        response = self.client.embeddings.create(model=self.model_name, input=texts)
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
     def _generate_anthropic(self,
                             prompt: str,
                             max_tokens: int,
@@ -191,7 +659,7 @@ class LLMModel:
             "model_name": self.model_name,
             "provider": self.provider.value,
             "api_key_set": bool(self.api_key),
-            "total_requests": len(self.request_history),
+            "total_requests": self._aggregates.count,
             "average_response_time": self._calculate_average_response_time(),
             "last_request_timestamp": self._get_last_request_timestamp()
         }
@@ -200,16 +668,13 @@ class LLMModel:
 
     def _calculate_average_response_time(self) -> float:
         """Вычисляет среднее время ответа"""
-        if not self.request_history:
+        if not self._aggregates.count:
             return 0.0
-        total_duration = sum(req["duration"] for req in self.request_history)
-        return total_duration / len(self.request_history)
+        return self._aggregates.total_duration / self._aggregates.count
 
     def _get_last_request_timestamp(self) -> Optional[datetime]:
         """Возвращает временную метку последнего запроса"""
-        if not self.request_history:
-            return None
-        return self.request_history[-1]["timestamp"]
+        return self._aggregates.last_timestamp
 
     def get_request_history(self, limit: Optional[int] = None) -> list:
         """
@@ -221,7 +686,7 @@ class LLMModel:
         Returns:
             list: История запросов
         """
-        history = self.request_history
+        history = list(self.request_history)
         if limit:
             history = history[-limit:]
         return history
@@ -229,7 +694,32 @@ class LLMModel:
     def clear_history(self):
         """Очищает историю запросов"""
         logger.info("Clearing request history")
-        self.request_history = []
+        with self._history_lock:
+            self.request_history.clear()
+            self._aggregates.reset()
+
+    def close(self):
+        """Закрывает JSONL-файл истории запросов и собственный кэш ответов"""
+        with self._history_lock:
+            if self._history_sink is not None:
+                self._history_sink.close()
+                self._history_sink = None
+        if self._owns_cache and self.cache is not None:
+            self.cache.close()
+            self.cache = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @staticmethod
+    def _serialize_request(request: Dict[str, Any]) -> Dict[str, Any]:
+        """Готовит запись истории к сохранению в JSON"""
+        request_copy = request.copy()
+        request_copy["timestamp"] = request_copy["timestamp"].isoformat()
+        return request_copy
 
     def save_history_to_file(self, filename: str):
         """
@@ -238,18 +728,11 @@ class LLMModel:
         Args:
             filename (str): Путь к файлу
         """
-        import json
-        from datetime import datetime
-
         logger.info(f"Saving request history to file: {filename}")
 
         try:
             # Конвертируем datetime объекты в строки
-            history = []
-            for request in self.request_history:
-                request_copy = request.copy()
-                request_copy["timestamp"] = request_copy["timestamp"].isoformat()
-                history.append(request_copy)
+            history = [self._serialize_request(request) for request in self.get_request_history()]
 
             with open(filename, 'w', encoding='utf-8') as f:
                 json.dump(history, f, ensure_ascii=False, indent=2)
@@ -264,22 +747,27 @@ class LLMModel:
         Загружает историю запросов из файла
 
         Args:
-            filename (str): Путь к файлу
+            filename (str): Путь к файлу (JSON из save_history_to_file или JSONL из history_file)
         """
-        import json
-        from datetime import datetime
-
         logger.info(f"Loading request history from file: {filename}")
 
         try:
             with open(filename, 'r', encoding='utf-8') as f:
-                history = json.load(f)
+                if filename.endswith('.jsonl'):
+                    history = [json.loads(line) for line in f if line.strip()]
+                else:
+                    history = json.load(f)
 
             # Конвертируем строки обратно в datetime
             for request in history:
                 request["timestamp"] = datetime.fromisoformat(request["timestamp"])
 
-            self.request_history = history
+            with self._history_lock:
+                self.request_history.clear()
+                self._aggregates.reset()
+                for request in history:
+                    self.request_history.append(request)
+                    self._aggregates.add(request)
             logger.success(f"Successfully loaded history from {filename}")
         except Exception as e:
             logger.error(f"Error loading history from file: {str(e)}")
@@ -292,14 +780,16 @@ class LLMModel:
         Returns:
             Dict[str, Any]: Статистика использования
         """
-        if not self.request_history:
+        aggregates = self._aggregates
+        if not aggregates.count:
             return {
                 "total_requests": 0,
                 "average_response_time": 0,
-                "total_tokens_generated": 0
+                "total_tokens_generated": 0,
+                **self._get_cache_statistics()
             }
 
-        total_requests = len(self.request_history)
+        total_requests = aggregates.count
         avg_response_time = self._calculate_average_response_time()
 
         logger.info(f"Calculating statistics for {total_requests} requests")
@@ -307,33 +797,43 @@ class LLMModel:
         return {
             "total_requests": total_requests,
             "average_response_time": avg_response_time,
-            "first_request_time": self.request_history[0]["timestamp"],
-            "last_request_time": self.request_history[-1]["timestamp"],
+            "first_request_time": aggregates.first_timestamp,
+            "last_request_time": aggregates.last_timestamp,
             "most_common_temperature": self._get_most_common_temperature(),
-            "average_prompt_length": self._calculate_average_prompt_length()
+            "average_prompt_length": self._calculate_average_prompt_length(),
+            "total_tokens_generated": aggregates.total_tokens_generated,
+            "average_time_to_first_token": aggregates.average("time_to_first_token"),
+            "average_tokens_per_second": aggregates.average("tokens_per_second"),
+            **self._get_cache_statistics()
+        }
+
+    def _get_cache_statistics(self) -> Dict[str, Any]:
+        """Возвращает счетчики попаданий и промахов кэша"""
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            "cache_enabled": self.cache is not None,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "cache_hit_ratio": self.cache_hits / lookups if lookups else 0.0
         }
 
     def _get_most_common_temperature(self) -> float:
         """Возвращает наиболее часто используемое значение temperature"""
-        if not self.request_history:
+        if not self._aggregates.count:
             return 0.0
-
-        temperatures = [req["parameters"]["temperature"] for req in self.request_history]
-        from collections import Counter
-        return Counter(temperatures).most_common(1)[0][0]
+        return self._aggregates.temperatures.most_common(1)[0][0]
 
     def _calculate_average_prompt_length(self) -> float:
         """Вычисляет среднюю длину промпта"""
-        if not self.request_history:
+        if not self._aggregates.count:
             return 0.0
-
-        total_length = sum(len(req["prompt"]) for req in self.request_history)
-        return total_length / len(self.request_history)
+        return self._aggregates.total_prompt_length / self._aggregates.count
 
     def _generate_ollama(self,
                          prompt: str,
                          max_tokens: int,
                          temperature: float,
+                         stats: Optional[Dict[str, Any]] = None,
                          **kwargs) -> str:
         """
         Генерация текста с помощью Ollama API
@@ -342,6 +842,7 @@ class LLMModel:
             prompt (str): Входной текст
             max_tokens (int): Максимальное количество токенов
             temperature (float): Температура генерации
+            stats (Optional[Dict[str, Any]]): Словарь, куда записываются метрики генерации
             **kwargs: Дополнительные параметры
 
         Returns:
@@ -351,8 +852,100 @@ class LLMModel:
 
         # Формируем URL для запроса
         url = f"{self.client}/api/generate"
+        payload = self._build_ollama_payload(prompt, max_tokens, temperature, kwargs)
+
+        try:
+            logger.debug(f"Ollama request payload: {payload}")
+            response = self.session.post(url, json=payload)
+            return self._parse_ollama_response(response, stats)
+
+        except Exception as e:
+            if is_connection_error(e):
+                error_msg = f"Failed to connect to Ollama server. Make sure it's running on {self.client}"
+                logger.error(error_msg)
+                raise ConnectionError(error_msg)
+            logger.error(f"Error in Ollama generation: {str(e)}")
+            raise
+
+    async def _agenerate_ollama(self,
+                                prompt: str,
+                                max_tokens: int,
+                                temperature: float,
+                                stats: Optional[Dict[str, Any]] = None,
+                                **kwargs) -> str:
+        """Асинхронная генерация текста с помощью Ollama API"""
+        logger.debug(f"Sending async request to Ollama API with model: {self.model_name}")
+
+        url = f"{self.client}/api/generate"
+        payload = self._build_ollama_payload(prompt, max_tokens, temperature, kwargs)
+
+        try:
+            response = await self._get_async_client().post(url, json=payload)
+            return self._parse_ollama_response(response, stats)
+
+        except Exception as e:
+            if is_connection_error(e):
+                error_msg = f"Failed to connect to Ollama server. Make sure it's running on {self.client}"
+                logger.error(error_msg)
+                raise ConnectionError(error_msg)
+            logger.error(f"Error in Ollama generation: {str(e)}")
+            raise
+
+    def _stream_ollama(self,
+                       prompt: str,
+                       max_tokens: int,
+                       temperature: float,
+                       **kwargs) -> Iterator[Any]:
+        """Потоковая генерация текста с помощью Ollama API"""
+        logger.debug(f"Sending streaming request to Ollama API with model: {self.model_name}")
+
+        url = f"{self.client}/api/generate"
+        payload = self._build_ollama_payload(prompt, max_tokens, temperature, kwargs)
+        payload["stream"] = True
 
-        # Подготавливаем параметры запроса
+        try:
+            if isinstance(self.session, httpx.Client):
+                response_context = self.session.stream("POST", url, json=payload)
+            else:
+                response_context = self.session.post(url, json=payload, stream=True)
+
+            with response_context as response:
+                if response.status_code != 200:
+                    if isinstance(response, httpx.Response):
+                        response.read()
+                    error_msg = f"Ollama API error: {response.status_code} - {response.text}"
+                    logger.error(error_msg)
+                    raise Exception(error_msg)
+
+                # Ollama присылает по одному JSON-объекту на строку
+                if isinstance(response, httpx.Response):
+                    lines = response.iter_lines()
+                else:
+                    # chunk_size=None - отдавать данные сразу по мере поступления
+                    lines = response.iter_lines(chunk_size=None)
+                for line in lines:
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get('response'):
+                        yield chunk['response']
+                    if chunk.get('done'):
+                        yield self._ollama_generation_stats(chunk)
+
+        except Exception as e:
+            if is_connection_error(e):
+                error_msg = f"Failed to connect to Ollama server. Make sure it's running on {self.client}"
+                logger.error(error_msg)
+                raise ConnectionError(error_msg)
+            logger.error(f"Error in Ollama generation: {str(e)}")
+            raise
+
+    def _build_ollama_payload(self,
+                              prompt: str,
+                              max_tokens: int,
+                              temperature: float,
+                              kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """Подготавливает параметры запроса к Ollama"""
         payload = {
             "model": self.model_name,
             "prompt": prompt,
@@ -369,34 +962,61 @@ class LLMModel:
         for param in supported_params:
             if param in kwargs:
                 payload[param] = kwargs[param]
-
+        if kwargs.get("json_mode"):
+            payload["format"] = "json"
+        return payload
+
+    def _parse_ollama_response(self, response: Any, stats: Optional[Dict[str, Any]] = None) -> str:
+        """Проверяет статус ответа Ollama и извлекает сгенерированный текст"""
+        if response.status_code != 200:
+            error_msg = f"Ollama API error: {response.status_code} - {response.text}"
+            logger.error(error_msg)
+            raise Exception(error_msg)
+
+        response_json = response.json()
+        generated_text = response_json.get('response', '')
+
+        # Логируем дополнительную информацию о генерации
+        if 'eval_count' in response_json:
+            logger.debug(f"Tokens generated: {response_json['eval_count']}")
+        if 'eval_duration' in response_json:
+            logger.debug(f"Generation time: {response_json['eval_duration']}ns")
+        if stats is not None:
+            stats.update(self._ollama_generation_stats(response_json))
+
+        return generated_text
+
+    @staticmethod
+    def _ollama_generation_stats(response_json: Dict[str, Any]) -> Dict[str, Any]:
+        """Переводит счетчики Ollama (длительности в наносекундах) в метрики генерации"""
+        stats = {}
+        if 'eval_count' in response_json:
+            stats["tokens_generated"] = response_json['eval_count']
+            if response_json.get('eval_duration'):
+                stats["tokens_per_second"] = response_json['eval_count'] / (response_json['eval_duration'] / 1e9)
+        if 'prompt_eval_duration' in response_json:
+            # Загрузка модели и обработка промпта на сервере - время до первого токена
+            server_ttft = response_json['prompt_eval_duration'] + response_json.get('load_duration', 0)
+            stats["server_time_to_first_token"] = server_ttft / 1e9
+        return stats
+
+    def _embed_ollama(self, texts: List[str]) -> List[List[float]]:
+        """Эмбеддинги с помощью Ollama API, все тексты одним запросом"""
         try:
-            logger.debug(f"Ollama request payload: {payload}")
-            response = requests.post(url, json=payload)
-
-            if response.status_code != 200:
-                error_msg = f"Ollama API error: {response.status_code} - {response.text}"
+            response = self.session.post(f"{self.client}/api/embed",
+                                         json={"model": self.model_name, "input": texts})
+        except Exception as e:
+            if is_connection_error(e):
+                error_msg = f"Failed to connect to Ollama server. Make sure it's running on {self.client}"
                 logger.error(error_msg)
-                raise Exception(error_msg)
-
-            response_json = response.json()
-            generated_text = response_json.get('response', '')
-
-            # Логируем дополнительную информацию о генерации
-            if 'eval_count' in response_json:
-                logger.debug(f"Tokens generated: {response_json['eval_count']}")
-            if 'eval_duration' in response_json:
-                logger.debug(f"Generation time: {response_json['eval_duration']}ns")
-
-            return generated_text
+                raise ConnectionError(error_msg)
+            raise
 
-        except requests.exceptions.ConnectionError:
-            error_msg = "Failed to connect to Ollama server. Make sure it's running on localhost:11434"
+        if response.status_code != 200:
+            error_msg = f"Ollama API error: {response.status_code} - {response.text}"
             logger.error(error_msg)
-            raise ConnectionError(error_msg)
-        except Exception as e:
-            logger.error(f"Error in Ollama generation: {str(e)}")
-            raise
+            raise Exception(error_msg)
+        return response.json()["embeddings"]
 
     def get_available_ollama_models(self) -> list:
         """
@@ -411,7 +1031,7 @@ class LLMModel:
 
         try:
             url = f"{self.client}/api/tags"
-            response = requests.get(url)
+            response = self.session.get(url)
 
             if response.status_code != 200:
                 logger.error(f"Failed to get Ollama models: {response.status_code}")
@@ -444,7 +1064,7 @@ class LLMModel:
             payload = {"name": model_name}
 
             logger.info(f"Pulling Ollama model: {model_name}")
-            response = requests.post(url, json=payload)
+            response = self.session.post(url, json=payload)
 
             if response.status_code != 200:
                 logger.error(f"Failed to pull model: {response.status_code}")
@@ -1,8 +1,12 @@
 import loguru
-from flows import arxiv_analysis_flow
+from flows import arxiv_analysis_flow, arxiv_streaming_flow, arxiv_resume_flow, arxiv_embedding_flow, \
+    arxiv_enrichment_flow, arxiv_export_flow
 from datetime import datetime
 import argparse
 from pathlib import Path
+from database import Database
+from config import METRICS_PORT, METRICS_TEXTFILE, EXPORT_DUCKDB_PATH
+from metrics import start_metrics_server, write_metrics_textfile
 
 # Настройка логирования
 logger = loguru.logger
@@ -15,26 +19,38 @@ def setup_folders():
         Path(folder).mkdir(exist_ok=True)
 
 
-def run_pipeline(max_papers: int = 100, save_results: bool = True):
+def run_pipeline(max_papers: int = 100, save_results: bool = True, streaming: bool = False,
+                 resume: bool = False, reanalyze: bool = False):
     """
     Запуск пайплайна обработки данных
 
     Args:
         max_papers (int): Максимальное количество статей для сбора
         save_results (bool): Сохранять ли результаты анализа
+        streaming (bool): Сохранять статьи небольшими пачками по мере анализа
+        resume (bool): Только проанализировать сохраненные статьи без анализа или с ошибкой
+        reanalyze (bool): Также переанализировать статьи другой модели или версии промпта
     """
     try:
         logger.info("Starting the ArXiv papers analysis pipeline")
         start_time = datetime.now()
 
         # Запуск flow
-        results = arxiv_analysis_flow(max_papers=max_papers)
+        if resume or reanalyze:
+            results = arxiv_resume_flow(reanalyze=reanalyze)
+            total_papers = results['total_papers']
+        elif streaming:
+            results = arxiv_streaming_flow(max_papers=max_papers)
+            total_papers = results['total_papers']
+        else:
+            results = arxiv_analysis_flow(max_papers=max_papers)
+            total_papers = len(results)
 
         # Логирование результатов
         execution_time = datetime.now() - start_time
         logger.info(f"Pipeline completed successfully in {execution_time}")
         logger.info("Summary of results:")
-        logger.info(f"Total papers processed: {results.__len__()}")
+        logger.info(f"Total papers processed: {total_papers}")
 
         return results
 
@@ -57,6 +73,52 @@ def main():
         action='store_true',
         help='Do not save results to disk'
     )
+    parser.add_argument(
+        '--stream',
+        action='store_true',
+        help='Save analyzed papers in micro-batches as they complete'
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Only analyze stored papers that are unanalyzed or failed'
+    )
+    parser.add_argument(
+        '--reanalyze',
+        action='store_true',
+        help='Like --resume, also re-analyze papers from another model or prompt version'
+    )
+    parser.add_argument(
+        '--embed',
+        action='store_true',
+        help='Embed abstracts of new papers for related-paper search after the run'
+    )
+    parser.add_argument(
+        '--enrich',
+        action='store_true',
+        help='Fetch citation counts, venues and references from Semantic Scholar after the run'
+    )
+    parser.add_argument(
+        '--export',
+        action='store_true',
+        help='Export changed months of papers to Parquet for the dashboard after the run'
+    )
+    parser.add_argument(
+        '--export-duckdb',
+        default=EXPORT_DUCKDB_PATH,
+        help='With --export, also register the Parquet files as views in this DuckDB file'
+    )
+    parser.add_argument(
+        '--metrics-port',
+        type=int,
+        default=METRICS_PORT,
+        help='Serve Prometheus metrics at http://127.0.0.1:PORT/metrics'
+    )
+    parser.add_argument(
+        '--metrics-file',
+        default=METRICS_TEXTFILE,
+        help='Write Prometheus metrics to this file after the run'
+    )
     parser.add_argument(
         '--debug',
         action='store_true',
@@ -73,18 +135,41 @@ def main():
     logger.info(f"Max papers to collect: {args.max_papers}")
     logger.info(f"Save results: {not args.no_save}")
 
+    if args.metrics_port is not None:
+        start_metrics_server(args.metrics_port)
+
     try:
         # Запуск пайплайна
         results = run_pipeline(
             max_papers=args.max_papers,
-            save_results=not args.no_save
+            save_results=not args.no_save,
+            streaming=args.stream,
+            resume=args.resume,
+            reanalyze=args.reanalyze
         )
-
-        # Вывод итоговой информации
+        if args.embed:
+            embedded = arxiv_embedding_flow()
+            logger.info(f"Embedded papers: {embedded}")
+        if args.enrich:
+            enriched = arxiv_enrichment_flow()
+            logger.info(f"Enriched papers: {enriched['found_papers']} of {enriched['total_papers']} "
+                        f"found on Semantic Scholar")
+        if args.export:
+            exported = arxiv_export_flow(duckdb_path=args.export_duckdb)
+            logger.info(f"Exported papers: {exported['papers']} in {exported['months']} months")
+
+        # Вывод итоговой информации; статистика корпуса берется из сводных таблиц БД
+        processed = results['total_papers'] if isinstance(results, dict) else len(results)
+        summary = Database().get_summary()
         print("\n=== Pipeline Execution Summary ===")
-        print(f"Total papers processed: {results.get('total_papers', 0)}")
-        print(f"Unique authors: {results.get('unique_authors', 0)}")
-        print(f"Date range: {results.get('date_range', 'N/A')}")
+        print(f"Total papers processed: {processed}")
+        print(f"Papers in database: {summary['total_papers']}")
+        print(f"Unique authors: {summary['unique_authors']}")
+        print(f"Mean authors per paper: {summary['mean_authors_per_paper']:.2f}")
+        print(f"Date range: {summary['date_range']}")
+        top_categories = list(summary['papers_per_category'].items())[:5]
+        if top_categories:
+            print("Top categories: " + ", ".join(f"{name} ({count})" for name, count in top_categories))
         print("\nResults have been saved to:")
         print("- Database: arxiv_papers.db")
         print("- Visualizations: ./eda_results/")
@@ -97,6 +182,9 @@ def main():
         logger.error(f"Pipeline failed: {str(e)}")
         print(f"\nPipeline failed: {str(e)}")
         raise
+    finally:
+        if args.metrics_file:
+            write_metrics_textfile(args.metrics_file)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,318 @@
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.engine import Engine
+
+from db_model import Base
+from config import DB_PATH
+from utils import logger, parse_arxiv_id, content_hash
+
+
+def _is_legacy_author_schema(engine: Engine) -> bool:
+    """Old schema stored one authors/categories row per (paper, name)"""
+    inspector = inspect(engine)
+    if 'authors' not in inspector.get_table_names():
+        return False
+    return 'paper_id' in {column['name'] for column in inspector.get_columns('authors')}
+
+
+def normalize_authors_and_categories(engine: Engine):
+    """
+    Convert per-paper author/category rows into shared entity tables
+    linked through paper_authors and paper_categories, in place.
+    """
+    logger.info("Migrating authors and categories to the normalized schema")
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE authors RENAME TO authors_legacy"))
+        conn.execute(text("ALTER TABLE categories RENAME TO categories_legacy"))
+        # Indexes keep their names after the rename, drop them before create_all
+        for table in ('authors_legacy', 'categories_legacy'):
+            for index in inspect(conn).get_indexes(table):
+                conn.execute(text(f'DROP INDEX "{index["name"]}"'))
+
+        Base.metadata.create_all(conn, tables=[
+            Base.metadata.tables[name]
+            for name in ('authors', 'categories', 'paper_authors', 'paper_categories')
+        ])
+
+        conn.execute(text(
+            "INSERT INTO authors (author_name) "
+            "SELECT DISTINCT author_name FROM authors_legacy WHERE paper_id IS NOT NULL"
+        ))
+        # rowid order is the order in which authors were inserted for a paper
+        conn.execute(text(
+            "INSERT INTO paper_authors (paper_id, position, author_id) "
+            "SELECT l.paper_id, "
+            "       ROW_NUMBER() OVER (PARTITION BY l.paper_id ORDER BY l.rowid) - 1, "
+            "       a.id "
+            "FROM authors_legacy l JOIN authors a ON a.author_name = l.author_name "
+            "WHERE l.paper_id IS NOT NULL"
+        ))
+
+        conn.execute(text(
+            "INSERT INTO categories (category_name) "
+            "SELECT DISTINCT category_name FROM categories_legacy WHERE paper_id IS NOT NULL"
+        ))
+        conn.execute(text(
+            "INSERT OR IGNORE INTO paper_categories (paper_id, category_id) "
+            "SELECT l.paper_id, c.id "
+            "FROM categories_legacy l JOIN categories c ON c.category_name = l.category_name "
+            "WHERE l.paper_id IS NOT NULL"
+        ))
+
+        conn.execute(text("DROP TABLE authors_legacy"))
+        conn.execute(text("DROP TABLE categories_legacy"))
+    logger.info("Authors and categories migration finished")
+
+
+STRUCTURED_ANALYSIS_COLUMNS = ('main_topic', 'key_findings', 'complexity')
+
+
+def add_structured_analysis_columns(engine: Engine):
+    """Add main_topic, key_findings and complexity columns to papers"""
+    inspector = inspect(engine)
+    if 'papers' not in inspector.get_table_names():
+        return
+    existing = {column['name'] for column in inspector.get_columns('papers')}
+    missing = [name for name in STRUCTURED_ANALYSIS_COLUMNS if name not in existing]
+    if not missing:
+        return
+
+    logger.info(f"Adding structured analysis columns to papers: {missing}")
+    with engine.begin() as conn:
+        for name in missing:
+            conn.execute(text(f"ALTER TABLE papers ADD COLUMN {name} VARCHAR"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_papers_complexity ON papers (complexity)"))
+
+
+PROCESSING_STATE_COLUMNS = {
+    'status': "VARCHAR NOT NULL DEFAULT 'collected'",
+    'attempts': "INTEGER NOT NULL DEFAULT 0",
+    'llm_model': "VARCHAR",
+    'prompt_version': "VARCHAR",
+    'llm_error': "VARCHAR",
+}
+
+
+def add_processing_state_columns(engine: Engine):
+    """Add per-paper processing state to papers, marking analyzed papers as such"""
+    inspector = inspect(engine)
+    if 'papers' not in inspector.get_table_names():
+        return
+    existing = {column['name'] for column in inspector.get_columns('papers')}
+    missing = [name for name in PROCESSING_STATE_COLUMNS if name not in existing]
+    if not missing:
+        return
+
+    logger.info(f"Adding processing state columns to papers: {missing}")
+    with engine.begin() as conn:
+        for name in missing:
+            conn.execute(text(f"ALTER TABLE papers ADD COLUMN {name} {PROCESSING_STATE_COLUMNS[name]}"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_papers_status ON papers (status)"))
+        if 'status' in missing:
+            # The model and prompt of earlier analyses are unknown
+            conn.execute(text(
+                "UPDATE papers SET status = 'analyzed', attempts = 1 WHERE llm_analysis IS NOT NULL"
+            ))
+
+
+VERSION_COLUMNS = {
+    'version': "INTEGER",
+    'content_hash': "VARCHAR",
+}
+
+# Tables whose paper_id refers to papers.id
+PAPER_CHILD_TABLES = ('paper_authors', 'paper_categories', 'paper_embeddings', 'paper_enrichment', 'paper_references')
+
+
+def key_papers_by_arxiv_id(engine: Engine):
+    """
+    Re-key papers from versioned entry URLs to unversioned arXiv ids and
+    fill the version and content_hash columns. Where several versions of
+    a paper are stored, the latest one is kept.
+    """
+    inspector = inspect(engine)
+    tables = inspector.get_table_names()
+    if 'papers' not in tables:
+        return
+    existing = {column['name'] for column in inspector.get_columns('papers')}
+    missing = [name for name in VERSION_COLUMNS if name not in existing]
+    if not missing:
+        return
+
+    logger.info("Keying papers by unversioned arXiv id")
+    child_tables = [table for table in PAPER_CHILD_TABLES if table in tables]
+    with engine.begin() as conn:
+        for name in missing:
+            conn.execute(text(f"ALTER TABLE papers ADD COLUMN {name} {VERSION_COLUMNS[name]}"))
+
+        rows = []
+        latest = {}
+        for old_id, title, abstract in conn.execute(text("SELECT id, title, abstract FROM papers")):
+            try:
+                new_id, version = parse_arxiv_id(old_id)
+            except ValueError:
+                new_id, version = old_id, None
+            rows.append({'old_id': old_id, 'new_id': new_id, 'version': version,
+                         'content_hash': content_hash(title, abstract)})
+            if new_id not in latest or (version or 0) > (latest[new_id]['version'] or 0):
+                latest[new_id] = rows[-1]
+
+        kept = {row['old_id'] for row in latest.values()}
+        stale = [{'old_id': row['old_id']} for row in rows if row['old_id'] not in kept]
+        renamed = [row for row in latest.values() if row['old_id'] != row['new_id']]
+        if stale:
+            logger.info(f"Dropping {len(stale)} superseded paper versions")
+            for table in child_tables:
+                conn.execute(text(f"DELETE FROM {table} WHERE paper_id = :old_id"), stale)
+            conn.execute(text("DELETE FROM papers WHERE id = :old_id"), stale)
+        if renamed:
+            for table in child_tables:
+                conn.execute(text(f"UPDATE {table} SET paper_id = :new_id WHERE paper_id = :old_id"), renamed)
+        if latest:
+            conn.execute(text(
+                "UPDATE papers SET id = :new_id, version = :version, content_hash = :content_hash "
+                "WHERE id = :old_id"
+            ), list(latest.values()))
+    logger.info(f"Papers keyed by arXiv id: {len(latest)} papers")
+
+
+def drop_harvest_entry_id(engine: Engine):
+    """Drop harvest_state.last_entry_id, which was written but never read"""
+    inspector = inspect(engine)
+    if 'harvest_state' not in inspector.get_table_names():
+        return
+    if 'last_entry_id' not in {column['name'] for column in inspector.get_columns('harvest_state')}:
+        return
+    logger.info("Dropping harvest_state.last_entry_id")
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE harvest_state DROP COLUMN last_entry_id"))
+
+
+def add_published_index(engine: Engine):
+    """Index papers.published for date-range reads such as the monthly export"""
+    if 'papers' not in inspect(engine).get_table_names():
+        return
+    with engine.begin() as conn:
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_papers_published ON papers (published)"))
+
+
+SEARCH_INDEX_DDL = [
+    # External-content table: the text lives only in papers, the index
+    # refers to papers.rowid. The analysis is indexed through its text
+    # fields, not the llm_analysis JSON, whose keys would match every paper.
+    "CREATE VIRTUAL TABLE papers_fts USING fts5("
+    "title, abstract, main_topic, key_findings, "
+    "content='papers', content_rowid='rowid', tokenize='porter unicode61')",
+    "CREATE TRIGGER papers_fts_ai AFTER INSERT ON papers BEGIN "
+    "INSERT INTO papers_fts (rowid, title, abstract, main_topic, key_findings) "
+    "VALUES (new.rowid, new.title, new.abstract, new.main_topic, new.key_findings); "
+    "END",
+    "CREATE TRIGGER papers_fts_ad AFTER DELETE ON papers BEGIN "
+    "INSERT INTO papers_fts (papers_fts, rowid, title, abstract, main_topic, key_findings) "
+    "VALUES ('delete', old.rowid, old.title, old.abstract, old.main_topic, old.key_findings); "
+    "END",
+    "CREATE TRIGGER papers_fts_au AFTER UPDATE OF title, abstract, main_topic, key_findings ON papers BEGIN "
+    "INSERT INTO papers_fts (papers_fts, rowid, title, abstract, main_topic, key_findings) "
+    "VALUES ('delete', old.rowid, old.title, old.abstract, old.main_topic, old.key_findings); "
+    "INSERT INTO papers_fts (rowid, title, abstract, main_topic, key_findings) "
+    "VALUES (new.rowid, new.title, new.abstract, new.main_topic, new.key_findings); "
+    "END",
+]
+
+SEARCH_INDEX_TRIGGERS = ('papers_fts_ai', 'papers_fts_ad', 'papers_fts_au')
+
+
+def drop_json_search_index(engine: Engine):
+    """
+    Drop a search index over the llm_analysis JSON, so that
+    ensure_search_index recreates and rebuilds it over the analysis fields
+    """
+    with engine.connect() as conn:
+        sql = conn.execute(text("SELECT sql FROM sqlite_master WHERE name = 'papers_fts'")).scalar()
+    if sql is None or 'llm_analysis' not in sql:
+        return
+
+    logger.info("Dropping the full-text search index over llm_analysis")
+    with engine.begin() as conn:
+        for trigger in SEARCH_INDEX_TRIGGERS:
+            conn.execute(text(f"DROP TRIGGER IF EXISTS {trigger}"))
+        conn.execute(text("DROP TABLE papers_fts"))
+
+
+def ensure_search_index(engine: Engine):
+    """Create the FTS5 index over papers and its sync triggers if missing"""
+    if 'papers_fts' in inspect(engine).get_table_names():
+        return
+
+    logger.info("Creating full-text search index over papers")
+    with engine.begin() as conn:
+        for statement in SEARCH_INDEX_DDL:
+            conn.execute(text(statement))
+        rebuild_search_index(conn)
+
+
+def rebuild_search_index(conn):
+    """
+    Re-index every paper. Needed after VACUUM, which may renumber the
+    rowids of papers since it has no INTEGER PRIMARY KEY.
+    """
+    conn.execute(text("INSERT INTO papers_fts (papers_fts) VALUES ('rebuild')"))
+
+
+PAPER_STATS_DDL = [
+    "DELETE FROM paper_stats",
+    "INSERT INTO paper_stats (kind, key, count) "
+    "SELECT 'total', 'papers', COUNT(*) FROM papers",
+    "INSERT INTO paper_stats (kind, key, count) "
+    "SELECT 'total', 'authors', COUNT(DISTINCT author_id) FROM paper_authors",
+    "INSERT INTO paper_stats (kind, key, count) "
+    "SELECT 'month', strftime('%Y-%m', published), COUNT(*) FROM papers "
+    "WHERE published IS NOT NULL GROUP BY 2",
+    "INSERT INTO paper_stats (kind, key, count) "
+    "SELECT 'category', c.category_name, COUNT(*) "
+    "FROM paper_categories pc JOIN categories c ON c.id = pc.category_id GROUP BY c.category_name",
+    "INSERT INTO paper_stats (kind, key, count) "
+    "SELECT 'authors_per_paper', CAST(authors AS TEXT), COUNT(*) FROM ("
+    "SELECT COUNT(pa.author_id) AS authors FROM papers p "
+    "LEFT JOIN paper_authors pa ON pa.paper_id = p.id GROUP BY p.id"
+    ") GROUP BY authors",
+]
+
+
+def ensure_paper_stats(engine: Engine):
+    """Fill the paper_stats rollup from scratch if it was never filled"""
+    with engine.connect() as conn:
+        filled = conn.execute(text(
+            "SELECT 1 FROM paper_stats WHERE kind = 'total' AND key = 'papers'"
+        )).first()
+    if filled:
+        return
+
+    logger.info("Computing corpus statistics")
+    with engine.begin() as conn:
+        rebuild_paper_stats(conn)
+
+
+def rebuild_paper_stats(conn):
+    """Recompute paper_stats from the papers and their links"""
+    for statement in PAPER_STATS_DDL:
+        conn.execute(text(statement))
+
+
+def run_migrations(engine: Engine):
+    """Apply pending schema migrations to an existing database"""
+    if _is_legacy_author_schema(engine):
+        normalize_authors_and_categories(engine)
+    add_structured_analysis_columns(engine)
+    add_processing_state_columns(engine)
+    key_papers_by_arxiv_id(engine)
+    drop_json_search_index(engine)
+    add_published_index(engine)
+    drop_harvest_entry_id(engine)
+
+
+if __name__ == "__main__":
+    engine = create_engine(f'sqlite:///{DB_PATH}')
+    run_migrations(engine)
+    Base.metadata.create_all(engine)
+    ensure_search_index(engine)
+    ensure_paper_stats(engine)
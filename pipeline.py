@@ -0,0 +1,104 @@
+"""
+Analyze-and-save steps shared by the flows in flows.py and by benchmark.py.
+
+These are plain generators over paper dicts with no Prefect dependency, so
+the benchmark measures the same path the flows run.
+"""
+from itertools import islice
+
+from preproc import LLMProcessor
+from config import LLM_MAX_CONCURRENCY, LLM_PACK_SIZE, DB_FLUSH_SIZE, PAPERS_PER_REQUEST
+from metrics import PIPELINE_STAGE_DURATION
+
+MODEL_NAME = "ollama/qwen2.5-coder:latest"
+
+
+def analyze_and_save(papers, db, query=None, processor=None, max_workers=LLM_MAX_CONCURRENCY,
+                     flush_size=DB_FLUSH_SIZE, pack_size=LLM_PACK_SIZE):
+    """
+    Analyze papers and save them every flush_size papers, yielding each saved
+    batch. A crash loses at most the unsaved batch; the rest is resumable.
+    """
+    # A processor made here is closed here; a passed one belongs to the caller
+    owned = processor is None
+    processor = processor or LLMProcessor(MODEL_NAME)
+    try:
+        batch = []
+        for paper in processor.iter_process_papers(papers, max_workers=max_workers, pack_size=pack_size):
+            batch.append(paper)
+            if len(batch) >= flush_size:
+                save_batch(db, batch, query)
+                yield batch
+                batch = []
+        if batch:
+            save_batch(db, batch, query)
+            yield batch
+    finally:
+        if owned:
+            processor.close()
+
+
+class Skipped:
+    """
+    Papers skip_unchanged left out: only their number and the newest one,
+    which is all the watermark needs, so memory does not grow with the run.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.newest = None
+
+    def add(self, paper):
+        self.count += 1
+        if paper.get('updated_at') and (self.newest is None or paper['updated_at'] > self.newest['updated_at']):
+            self.newest = {'id': paper['id'], 'updated_at': paper['updated_at']}
+
+    def __len__(self):
+        return self.count
+
+
+def skip_unchanged(papers, db, skipped, chunk_size=PAPERS_PER_REQUEST):
+    """
+    Filter a paper stream through Database.filter_changed, chunk_size papers
+    at a time. Skipped papers are counted in skipped, a Skipped.
+    """
+    papers = iter(papers)
+    while True:
+        chunk = list(islice(papers, chunk_size))
+        if not chunk:
+            return
+        changed = db.filter_changed(chunk)
+        changed_ids = {paper['id'] for paper in changed}
+        for paper in chunk:
+            if paper['id'] not in changed_ids:
+                skipped.add(paper)
+        yield from changed
+
+
+def stream_and_save(papers, db, query, skipped, processor=None, max_workers=LLM_MAX_CONCURRENCY,
+                    flush_size=DB_FLUSH_SIZE, pack_size=LLM_PACK_SIZE):
+    """
+    Skip unchanged papers, analyze and save the rest in collection order,
+    yielding each saved batch. Once the stream is exhausted the watermark
+    of query also passes the skipped papers.
+    """
+    yield from analyze_and_save(skip_unchanged(papers, db, skipped), db, query, processor,
+                                max_workers, flush_size, pack_size)
+    # Everything before the skipped papers is saved by now
+    if skipped.newest is not None:
+        db.update_watermark(query, [skipped.newest])
+
+
+def save_batch(db, papers, query=None):
+    with PIPELINE_STAGE_DURATION.time(stage="save"):
+        db.save_papers(papers)
+        if query is not None:
+            db.update_watermark(query, papers)
+
+
+def summarize(batches):
+    summary = {'total_papers': 0, 'failed_papers': 0}
+    for batch in batches:
+        summary['total_papers'] += len(batch)
+        summary['failed_papers'] += sum(1 for paper in batch if paper.get('status') == 'failed')
+    return summary
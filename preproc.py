@@ -1,27 +1,329 @@
 from openai import OpenAI
-from typing import Dict
-from config import OPENAI_API_KEY
+from typing import Dict, List, Iterable, Iterator, Optional
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from itertools import islice
+import asyncio
+import json
+from config import (
+    OPENAI_API_KEY, LLM_MAX_CONCURRENCY, LLM_JSON_RETRIES,
+    LLM_PACK_SIZE, LLM_PACK_MAX_PROMPT_CHARS, LLM_TOKENS_PER_ANALYSIS,
+    EMBEDDING_MODEL, EMBEDDING_BATCH_SIZE
+)
 from ollama import Client
 from llmclient import LLMModel
+from loguru import logger
+from metrics import PIPELINE_QUEUE_DEPTH
+
+COMPLEXITY_LEVELS = ("Low", "Medium", "High")
+# Stored with every analysis; bump when _build_prompt or _build_pack_prompt
+# change so that arxiv_resume_flow(reanalyze=True) picks the papers up again
+PROMPT_VERSION = "1"
+
+
+def parse_analysis(response: str) -> Dict:
+    """
+    Validate a JSON analysis returned by the model.
+
+    Returns the analysis fields as stored on a paper; raises ValueError
+    if the response is not valid JSON or does not match the schema.
+    """
+    try:
+        data = json.loads(response)
+    except (TypeError, json.JSONDecodeError) as e:
+        raise ValueError(f"Analysis is not valid JSON: {str(e)}")
+    return validate_analysis(data)
+
+
+def validate_analysis(data: Dict) -> Dict:
+    """Validate an already decoded analysis object, see parse_analysis"""
+    if not isinstance(data, dict):
+        raise ValueError("Analysis must be a JSON object")
+
+    main_topic = data.get('main_topic')
+    if not isinstance(main_topic, str) or not main_topic.strip():
+        raise ValueError("main_topic must be a non-empty string")
+
+    key_findings = data.get('key_findings')
+    if isinstance(key_findings, str):
+        key_findings = [key_findings]
+    if (not isinstance(key_findings, list) or not key_findings
+            or not all(isinstance(finding, str) for finding in key_findings)):
+        raise ValueError("key_findings must be a list of strings")
+
+    complexity = str(data.get('complexity', '')).strip().capitalize()
+    if complexity not in COMPLEXITY_LEVELS:
+        raise ValueError(f"complexity must be one of {COMPLEXITY_LEVELS}, got {data.get('complexity')!r}")
+
+    analysis = {
+        'main_topic': main_topic.strip(),
+        'key_findings': [finding.strip() for finding in key_findings],
+        'complexity': complexity
+    }
+    return {'llm_analysis': json.dumps(analysis, ensure_ascii=False), **analysis}
 
 class LLMProcessor:
-    def __init__(self, model):
-        self.model = LLMModel(model_name=model)
+    def __init__(self, model, **model_kwargs):
+        # model_kwargs are passed to LLMModel, e.g. use_cache or base_url
+        self.model_name = model
+        self.model = LLMModel(model_name=model, **model_kwargs)
+
+    def close(self):
+        """Release the model's history file and response cache"""
+        self.model.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
     def process_paper(self, paper: Dict) -> Dict:
-        prompt = f"""
-        Analyze the following research paper and provide:
-        1. Main topic (one sentence)
-        2. Key findings (2-3 points)
-        3. Technical complexity (Low/Medium/High)
+        prompt = self._build_prompt(paper)
+        for attempt in range(LLM_JSON_RETRIES + 1):
+            response = self.model.generate(prompt, json_mode=True)
+            try:
+                paper.update(parse_analysis(response))
+                return self._mark_analyzed(paper)
+            except ValueError as e:
+                self._handle_malformed(paper, prompt, attempt, e)
+
+    async def aprocess_paper(self, paper: Dict) -> Dict:
+        prompt = self._build_prompt(paper)
+        for attempt in range(LLM_JSON_RETRIES + 1):
+            response = await self.model.agenerate(prompt, json_mode=True)
+            try:
+                paper.update(parse_analysis(response))
+                return self._mark_analyzed(paper)
+            except ValueError as e:
+                self._handle_malformed(paper, prompt, attempt, e)
+
+    def _handle_malformed(self, paper: Dict, prompt: str, attempt: int, error: ValueError):
+        # Drop the bad answer from the cache so the retry asks the model again
+        self.model.forget_cached_response(prompt, json_mode=True)
+        if attempt == LLM_JSON_RETRIES:
+            raise ValueError(f"Malformed analysis after {attempt + 1} attempts: {str(error)}")
+        logger.warning(f"Malformed analysis for paper {paper.get('id')} (attempt {attempt + 1}): {str(error)}")
+
+    def _mark_analyzed(self, paper: Dict) -> Dict:
+        paper['status'] = 'analyzed'
+        paper['llm_model'] = self.model_name
+        paper['prompt_version'] = PROMPT_VERSION
+        paper['llm_error'] = None
+        return paper
+
+    @staticmethod
+    def _mark_failed(paper: Dict, error: Exception) -> Dict:
+        paper['status'] = 'failed'
+        paper['llm_analysis'] = None
+        paper['llm_error'] = str(error)
+        return paper
+
+    @staticmethod
+    def _build_prompt(paper: Dict) -> str:
+        return f"""
+        Analyze the following research paper. Respond with a single JSON object
+        with exactly these keys:
+        "main_topic": the main topic in one sentence,
+        "key_findings": a list of 2-3 short strings,
+        "complexity": technical complexity, one of "Low", "Medium", "High".
 
         Title: {paper['title']}
         Abstract: {paper['abstract']}
         """
 
-        response = self.model.generate(prompt)
+    def process_pack(self, papers: List[Dict]) -> List[Dict]:
+        """
+        Analyzes several papers with a single request.
+
+        Each paper gets an identifier (P1, P2, ...) in the prompt and the model
+        answers with one JSON object keyed by these identifiers. Papers missing
+        from the answer or with an invalid entry are re-analyzed one by one;
+        failures are recorded per paper as in process_papers.
+        """
+        if len(papers) == 1:
+            return [self._safe_process_paper(papers[0])]
+
+        ids = [f"P{i}" for i in range(1, len(papers) + 1)]
+        try:
+            response = self.model.generate(
+                self._build_pack_prompt(ids, papers),
+                max_tokens=LLM_TOKENS_PER_ANALYSIS * len(papers),
+                json_mode=True
+            )
+            analyses = json.loads(response)
+            if not isinstance(analyses, dict):
+                raise ValueError("Packed analysis must be a JSON object")
+        except Exception as e:
+            logger.warning(f"Packed analysis of {len(papers)} papers failed, falling back to single calls: {str(e)}")
+            analyses = {}
 
-        analysis = response
+        for paper_id, paper in zip(ids, papers):
+            try:
+                paper.update(validate_analysis(analyses.get(paper_id)))
+                self._mark_analyzed(paper)
+            except ValueError as e:
+                if analyses:
+                    logger.warning(f"No valid packed analysis for paper {paper.get('id')}: {str(e)}")
+                self._safe_process_paper(paper)
+        return papers
 
-        paper['llm_analysis'] = analysis
-        return paper
+    @staticmethod
+    def _build_pack_prompt(ids: List[str], papers: List[Dict]) -> str:
+        listing = "\n\n".join(
+            f"[{paper_id}]\nTitle: {paper['title']}\nAbstract: {paper['abstract']}"
+            for paper_id, paper in zip(ids, papers)
+        )
+        return f"""
+        Analyze each of the following research papers. Respond with a single
+        JSON object that has one key per paper identifier ({", ".join(ids)}).
+        Each value must be an object with exactly these keys:
+        "main_topic": the main topic in one sentence,
+        "key_findings": a list of 2-3 short strings,
+        "complexity": technical complexity, one of "Low", "Medium", "High".
+
+        {listing}
+        """
+
+    @staticmethod
+    def _iter_packs(papers: Iterable[Dict], pack_size: int, max_prompt_chars: int) -> Iterator[List[Dict]]:
+        """Groups papers into packs of at most pack_size papers and max_prompt_chars of text"""
+        current, current_chars = [], 0
+        for paper in papers:
+            chars = len(paper['title']) + len(paper['abstract'] or '')
+            if current and (len(current) >= pack_size or current_chars + chars > max_prompt_chars):
+                yield current
+                current, current_chars = [], 0
+            current.append(paper)
+            current_chars += chars
+        if current:
+            yield current
+
+    def process_papers(self,
+                       papers: List[Dict],
+                       max_workers: int = LLM_MAX_CONCURRENCY,
+                       pack_size: int = LLM_PACK_SIZE,
+                       max_prompt_chars: int = LLM_PACK_MAX_PROMPT_CHARS) -> List[Dict]:
+        """
+        Analyzes papers with at most max_workers requests in flight.
+
+        With pack_size > 1, up to pack_size papers (and max_prompt_chars of
+        titles and abstracts) share one request, see process_pack.
+
+        Results keep the input order. Every paper gets a 'status' of 'analyzed'
+        or 'failed'; a failed one is returned without llm_analysis and with the
+        error message under 'llm_error'.
+        """
+        results = list(self.iter_process_papers(
+            papers, max_workers=max_workers, pack_size=pack_size, max_prompt_chars=max_prompt_chars
+        ))
+        self._log_failures(results)
+        return results
+
+    def iter_process_papers(self,
+                            papers: Iterable[Dict],
+                            max_workers: int = LLM_MAX_CONCURRENCY,
+                            pack_size: int = LLM_PACK_SIZE,
+                            max_prompt_chars: int = LLM_PACK_MAX_PROMPT_CHARS,
+                            max_pending: Optional[int] = None) -> Iterator[Dict]:
+        """
+        Streaming variant of process_papers.
+
+        Papers are read from the iterable lazily and yielded in input order as
+        soon as their analysis is done. At most max_pending packs (default
+        2 * max_workers) are in flight or waiting for the consumer, so a slow
+        consumer stops reading of the input instead of piling up results.
+        """
+        max_workers = max(1, max_workers)
+        max_pending = max(1, max_pending or 2 * max_workers)
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for pack in self._iter_packs(papers, max(1, pack_size), max_prompt_chars):
+                PIPELINE_QUEUE_DEPTH.inc(len(pack), stage="llm")
+                pending.append(executor.submit(self._run_pack, pack))
+                while pending and (len(pending) >= max_pending or pending[0].done()):
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+
+    def _run_pack(self, pack: List[Dict]) -> List[Dict]:
+        try:
+            return self.process_pack(pack)
+        finally:
+            PIPELINE_QUEUE_DEPTH.dec(len(pack), stage="llm")
+
+    def _safe_process_paper(self, paper: Dict) -> Dict:
+        try:
+            return self.process_paper(paper)
+        except Exception as e:
+            logger.error(f"Failed to analyze paper {paper.get('id')}: {str(e)}")
+            return self._mark_failed(paper, e)
+
+    async def aprocess_papers(self, papers: List[Dict]) -> List[Dict]:
+        """
+        Analyzes all papers from one event loop.
+
+        Concurrency is bounded by the model's per-provider limits; results and
+        failures are reported the same way as in process_papers.
+        """
+        results = await asyncio.gather(
+            *(self.aprocess_paper(paper) for paper in papers),
+            return_exceptions=True
+        )
+
+        for paper, result in zip(papers, results):
+            if isinstance(result, Exception):
+                logger.error(f"Failed to analyze paper {paper.get('id')}: {str(result)}")
+                self._mark_failed(paper, result)
+
+        self._log_failures(papers)
+        return papers
+
+    @staticmethod
+    def _log_failures(papers: List[Dict]):
+        failed = sum(1 for paper in papers if paper.get('llm_error'))
+        if failed:
+            logger.warning(f"{failed} of {len(papers)} papers failed LLM analysis")
+
+
+class EmbeddingProcessor:
+    """Computes abstract embeddings for related-paper search, see Database.similar"""
+
+    def __init__(self, model: str = EMBEDDING_MODEL, **model_kwargs):
+        # model_kwargs are passed to LLMModel, e.g. base_url; the key is
+        # only used by OpenAI models such as openai/text-embedding-3-small
+        model_kwargs.setdefault('api_key', OPENAI_API_KEY)
+        self.model_name = model
+        self.model = LLMModel(model_name=model, use_cache=False, **model_kwargs)
+
+    def close(self):
+        """Release the model's history file"""
+        self.model.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def embed_papers(self, papers: Iterable[Dict], batch_size: int = EMBEDDING_BATCH_SIZE) -> Iterator[Dict[str, List[float]]]:
+        """
+        Yields {paper id: vector} for every batch_size papers, one request per
+        batch. A failed batch is logged and skipped; its papers stay without
+        an embedding and are picked up by the next run.
+        """
+        papers = iter(papers)
+        while True:
+            batch = list(islice(papers, batch_size))
+            if not batch:
+                return
+            try:
+                vectors = self.model.embed([self._embedding_text(paper) for paper in batch])
+            except Exception as e:
+                logger.error(f"Failed to embed {len(batch)} papers: {str(e)}")
+                continue
+            yield {paper['id']: vector for paper, vector in zip(batch, vectors)}
+
+    @staticmethod
+    def _embedding_text(paper: Dict) -> str:
+        return f"{paper['title']}\n\n{paper['abstract'] or ''}"
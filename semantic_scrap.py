@@ -1,25 +1,153 @@
-import requests
-from config import API_KEY, BASE_URL
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from config import API_KEY, BASE_URL, S2_BATCH_SIZE, S2_REQUESTS_PER_SECOND, S2_MAX_RETRIES
+from utils import get_http_session, is_connection_error, parse_arxiv_id, logger
+
+# Fields requested from /paper/batch for enrichment
+ENRICHMENT_FIELDS = (
+    "paperId,externalIds,venue,year,citationCount,referenceCount,influentialCitationCount,"
+    "references.paperId,references.externalIds"
+)
 
 
 class SemanticScholarClient:
-    def __init__(self):
-        self.headers = {"x-api-key": API_KEY}
+    def __init__(self, session=None, base_url: str = BASE_URL, api_key: Optional[str] = API_KEY,
+                 requests_per_second: float = S2_REQUESTS_PER_SECOND, max_retries: int = S2_MAX_RETRIES):
+        self.base_url = base_url
+        self.headers = {"x-api-key": api_key} if api_key else {}
+        # Reuse pooled keep-alive connections across requests
+        self.session = session or get_http_session()
+        self.min_interval = 1 / requests_per_second if requests_per_second else 0
+        self.max_retries = max_retries
+        self._last_request = 0.0
+        self._rate_lock = threading.Lock()
 
     def get_papers(self, query, limit=100):
-        endpoint = f"{BASE_URL}/paper/search"
+        endpoint = f"{self.base_url}/paper/search"
         params = {
             "query": query,
             "limit": limit
         }
+        return self._request("GET", endpoint, params=params)
+
+    def search_papers(self, query: str, max_results: int = 1000, page_size: int = 100,
+                      fields: Optional[str] = None) -> Iterator[Dict]:
+        """Yield search results page by page, following the API's 'next' offset"""
+        offset = 0
+        while offset < max_results:
+            params = {"query": query, "offset": offset, "limit": min(page_size, max_results - offset)}
+            if fields:
+                params["fields"] = fields
+            page = self._request("GET", f"{self.base_url}/paper/search", params=params)
+            yield from page.get("data", [])
+            if "next" not in page:
+                return
+            offset = page["next"]
+
+    def get_papers_batch(self, ids: List[str], fields: str = ENRICHMENT_FIELDS) -> List[Optional[Dict]]:
+        """
+        Look up to S2_BATCH_SIZE papers with one /paper/batch request.
+
+        ids may be any id the API accepts, e.g. 'ARXIV:2106.15928'. The result
+        is aligned with ids, with None for papers the API does not know.
+        """
+        return self._request("POST", f"{self.base_url}/paper/batch",
+                             params={"fields": fields}, json={"ids": ids})
+
+    def enrich_papers(self, paper_ids: Iterable[str], batch_size: int = S2_BATCH_SIZE) -> Iterator[List[Dict]]:
+        """
+        Resolve citation counts, venue and references for stored papers.
+
+        paper_ids are arXiv ids as stored in papers.id. Yields one list
+        of records (see Database.save_enrichment) per batch_size papers;
+        papers unknown to Semantic Scholar get a record with found=False.
+        """
+        batch = []
+        for paper_id in paper_ids:
+            try:
+                batch.append((paper_id, parse_arxiv_id(paper_id)[0]))
+            except ValueError:
+                logger.warning(f"Skipping enrichment of {paper_id}: not an arXiv id")
+                continue
+            if len(batch) >= batch_size:
+                yield self._enrich_batch(batch)
+                batch = []
+        if batch:
+            yield self._enrich_batch(batch)
+
+    def _enrich_batch(self, batch) -> List[Dict]:
+        items = self.get_papers_batch([f"ARXIV:{arxiv_id}" for _, arxiv_id in batch])
+        fetched_at = datetime.utcnow()
+        records = [self._to_record(paper_id, item, fetched_at) for (paper_id, _), item in zip(batch, items)]
+        logger.info(f"Enriched {sum(r['found'] for r in records)} of {len(records)} papers from Semantic Scholar")
+        return records
+
+    @staticmethod
+    def _to_record(paper_id: str, item: Optional[Dict], fetched_at: datetime) -> Dict:
+        if item is None:
+            return {'paper_id': paper_id, 'found': False, 'fetched_at': fetched_at, 'references': []}
+        references = []
+        for reference in item.get('references') or []:
+            if not reference.get('paperId'):
+                continue
+            arxiv_id = (reference.get('externalIds') or {}).get('ArXiv')
+            references.append({'cited_s2_id': reference['paperId'], 'cited_arxiv_id': arxiv_id})
+        return {
+            'paper_id': paper_id,
+            'found': True,
+            'fetched_at': fetched_at,
+            's2_paper_id': item.get('paperId'),
+            'venue': item.get('venue') or None,
+            'year': item.get('year'),
+            'citation_count': item.get('citationCount'),
+            'reference_count': item.get('referenceCount'),
+            'influential_citation_count': item.get('influentialCitationCount'),
+            'references': references
+        }
+
+    def _request(self, method: str, url: str, **kwargs):
+        """
+        Send a request within the rate limit and return its JSON body.
+
+        429 and 5xx responses and connection errors are retried up to
+        max_retries times, waiting Retry-After or an exponential backoff.
+        """
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_slot()
+            try:
+                response = self.session.request(method, url, headers=self.headers, **kwargs)
+            except Exception as e:
+                if not is_connection_error(e) or attempt == self.max_retries:
+                    raise
+                delay = 2 ** attempt
+                logger.warning(f"Semantic Scholar unreachable, retrying in {delay}s: {str(e)}")
+                time.sleep(delay)
+                continue
+
+            if response.status_code == 200:
+                return response.json()
+            retryable = response.status_code == 429 or response.status_code >= 500
+            if not retryable or attempt == self.max_retries:
+                raise Exception(f"API request failed with status {response.status_code}: {response.text[:200]}")
+            delay = self._retry_after(response)
+            if delay is None:
+                delay = 2 ** attempt
+            logger.warning(f"Semantic Scholar returned {response.status_code}, retrying in {delay}s")
+            time.sleep(delay)
 
-        response = requests.get(
-            endpoint,
-            headers=self.headers,
-            params=params
-        )
+    def _wait_for_slot(self):
+        with self._rate_lock:
+            wait = self._last_request + self.min_interval - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self._last_request = time.monotonic()
 
-        if response.status_code == 200:
-            return response.json()
-        else:
-            raise Exception(f"API request failed with status {response.status_code}")
+    @staticmethod
+    def _retry_after(response) -> Optional[float]:
+        try:
+            return float(response.headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            return None
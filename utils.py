@@ -1,7 +1,16 @@
+import hashlib
 import logging
-from typing import Any
+import re
+from typing import Any, Optional, Tuple
 from functools import wraps
+import threading
 import time
+import requests
+from requests.adapters import HTTPAdapter
+from config import (
+    HTTP_POOL_SIZE, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT,
+    HTTP_KEEPALIVE_EXPIRY, HTTP_USE_HTTP2
+)
 
 # Setup logging
 logging.basicConfig(
@@ -29,7 +38,104 @@ def retry_decorator(max_retries: int = 3, delay: int = 1):
         return wrapper
     return decorator
 
+# New-style (2106.15928) and old-style (hep-th/9901001) ids, optionally versioned
+_ARXIV_ID = re.compile(r'(?P<id>\d{4}\.\d{4,5}|[a-z][a-z\-]*(?:\.[A-Z]{2})?/\d{7})(?:v(?P<version>\d+))?$', re.I)
+
+
+def parse_arxiv_id(value: str) -> Tuple[str, Optional[int]]:
+    """
+    Split an arXiv entry id, URL or bare id into the id and its version,
+    e.g. 'http://arxiv.org/abs/2106.15928v2' -> ('2106.15928', 2).
+    """
+    match = _ARXIV_ID.search(value.strip())
+    if match is None:
+        raise ValueError(f"Not an arXiv id: {value!r}")
+    version = match.group('version')
+    return match.group('id'), int(version) if version else None
+
+
+def content_hash(title: str, abstract: Optional[str]) -> str:
+    """Fingerprint of the analyzed text of a paper, insensitive to whitespace changes"""
+    text = " ".join(title.split()) + "\n" + " ".join((abstract or "").split())
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
 def validate_paper(paper: dict) -> bool:
     """Validate paper data structure"""
     required_fields = ['id', 'title', 'abstract', 'authors', 'published', 'updated', 'categories']
     return all(field in paper for field in required_fields)
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that applies a default timeout to every request"""
+
+    def __init__(self, timeout, *args, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def create_http_session(pool_size: int = HTTP_POOL_SIZE,
+                        connect_timeout: float = HTTP_CONNECT_TIMEOUT,
+                        read_timeout: float = HTTP_READ_TIMEOUT,
+                        keepalive_expiry: float = HTTP_KEEPALIVE_EXPIRY,
+                        http2: bool = HTTP_USE_HTTP2):
+    """
+    Create a keep-alive HTTP client with a connection pool.
+
+    Returns a requests.Session, or an httpx.Client when http2 is set
+    (requires `pip install httpx[http2]`). Both expose get/post with
+    the same call signatures used in this project.
+    """
+    if http2:
+        try:
+            import httpx
+        except ImportError:
+            raise ImportError("HTTP/2 support requires httpx: pip install 'httpx[http2]'")
+        return httpx.Client(
+            http2=True,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=pool_size,
+                keepalive_expiry=keepalive_expiry
+            )
+        )
+
+    session = requests.Session()
+    adapter = TimeoutHTTPAdapter(
+        timeout=(connect_timeout, read_timeout),
+        pool_connections=pool_size,
+        pool_maxsize=pool_size
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+
+def get_http_session():
+    """Return the process-wide HTTP session shared by all API clients"""
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            _http_session = create_http_session()
+        return _http_session
+
+
+def is_connection_error(error: Exception) -> bool:
+    """Check whether error means the server could not be reached"""
+    if isinstance(error, requests.exceptions.ConnectionError):
+        return True
+    try:
+        import httpx
+    except ImportError:
+        return False
+    return isinstance(error, httpx.ConnectError)
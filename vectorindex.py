@@ -0,0 +1,176 @@
+import json
+import os
+import threading
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+from config import VECTOR_ANN, VECTOR_ANN_MIN_ROWS, VECTOR_ANN_EF
+from utils import logger
+
+DTYPE = np.dtype('<f4')
+
+
+def normalize(vectors) -> np.ndarray:
+    """L2-normalize rows as float32, so that a dot product is the cosine similarity"""
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=DTYPE))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class VectorIndex:
+    """
+    Unit-length float32 vectors in a flat file, searched by cosine similarity.
+
+    Row i of the file is row i of the matrix, which is memory-mapped for
+    search rather than loaded. Rows are only appended or overwritten in
+    place; which paper a row belongs to is tracked by the caller (see
+    Database.save_embeddings). The dimension is kept in path + '.json'.
+
+    Search is exact brute force over the matrix. With use_ann and at least
+    ann_min_rows rows it goes through an HNSW index (requires hnswlib),
+    which is extended with new rows on every search and persisted by save().
+    One writing process per file.
+    """
+
+    def __init__(self,
+                 path: str,
+                 use_ann: bool = VECTOR_ANN,
+                 ann_min_rows: int = VECTOR_ANN_MIN_ROWS,
+                 ann_ef: int = VECTOR_ANN_EF):
+        self.path = path
+        self.meta_path = path + '.json'
+        self.ann_path = path + '.hnsw'
+        self.use_ann = use_ann
+        self.ann_min_rows = ann_min_rows
+        self.ann_ef = ann_ef
+        self.dim: Optional[int] = None
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, encoding='utf-8') as f:
+                self.dim = json.load(f)['dim']
+        self._lock = threading.RLock()
+        self._matrix = None
+        self._ann = None
+        self._ann_rows = 0
+
+    def __len__(self) -> int:
+        if self.dim is None or not os.path.exists(self.path):
+            return 0
+        return os.path.getsize(self.path) // (self.dim * DTYPE.itemsize)
+
+    def append(self, vectors) -> np.ndarray:
+        """Append vectors as new rows and return their row numbers"""
+        with self._lock:
+            vectors = self._prepare(vectors)
+            start = len(self)
+            with open(self.path, 'ab') as f:
+                f.write(vectors.tobytes())
+            return np.arange(start, start + len(vectors))
+
+    def update(self, rows: Sequence[int], vectors):
+        """
+        Overwrite existing rows in place. A persisted HNSW index that is not
+        loaded here would keep the old vectors, so it is dropped and rebuilt
+        on the next search.
+        """
+        with self._lock:
+            vectors = self._prepare(vectors)
+            matrix = np.memmap(self.path, dtype=DTYPE, mode='r+', shape=(len(self), self.dim))
+            matrix[np.asarray(rows)] = vectors
+            matrix.flush()
+            del matrix
+            if self._ann is None:
+                self.rebuild_ann()
+            else:
+                updated = np.asarray(rows)
+                indexed = updated < self._ann_rows
+                if indexed.any():
+                    self._ann.add_items(vectors[indexed], updated[indexed])
+
+    def vector(self, row: int) -> np.ndarray:
+        return np.array(self._read_matrix()[row])
+
+    def search(self, query, k: int = 10) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the rows of the k most similar vectors and their cosine similarity, best first"""
+        with self._lock:
+            rows = len(self)
+            if rows == 0 or k <= 0:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=DTYPE)
+            query = normalize(query)[0]
+            k = min(k, rows)
+
+            ann = self._ann_index(rows)
+            if ann is not None:
+                ann.set_ef(max(self.ann_ef, k))
+                labels, distances = ann.knn_query(query, k=k)
+                return labels[0].astype(np.int64), 1 - distances[0]
+
+            matrix = self._read_matrix()
+        scores = matrix @ query
+        if k < rows:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(rows)
+        top = top[np.argsort(-scores[top])]
+        return top, scores[top]
+
+    def save(self):
+        """Persist the HNSW index, if one was built"""
+        with self._lock:
+            if self._ann is not None:
+                self._ann.save_index(self.ann_path)
+
+    def rebuild_ann(self):
+        """Drop the HNSW index; it is rebuilt from the matrix on the next search"""
+        with self._lock:
+            self._ann = None
+            self._ann_rows = 0
+            if os.path.exists(self.ann_path):
+                os.remove(self.ann_path)
+
+    def _prepare(self, vectors) -> np.ndarray:
+        vectors = normalize(vectors)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            with open(self.meta_path, 'w', encoding='utf-8') as f:
+                json.dump({'dim': self.dim}, f)
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Vectors of dimension {vectors.shape[1]} do not fit index {self.path} "
+                             f"of dimension {self.dim}")
+        return vectors
+
+    def _read_matrix(self) -> np.ndarray:
+        # Reopen the mapping only when rows were appended
+        rows = len(self)
+        if self._matrix is None or len(self._matrix) != rows:
+            self._matrix = np.memmap(self.path, dtype=DTYPE, mode='r', shape=(rows, self.dim))
+        return self._matrix
+
+    def _ann_index(self, rows: int):
+        if not self.use_ann or rows < self.ann_min_rows:
+            return None
+        if self._ann is None:
+            try:
+                import hnswlib
+            except ImportError:
+                logger.warning("hnswlib is not installed, using brute-force vector search")
+                self.use_ann = False
+                return None
+            index = hnswlib.Index(space='ip', dim=self.dim)
+            if os.path.exists(self.ann_path):
+                index.load_index(self.ann_path, max_elements=rows)
+                self._ann_rows = index.get_current_count()
+            else:
+                logger.info(f"Building HNSW index over {rows} vectors")
+                index.init_index(max_elements=rows, ef_construction=200, M=16)
+                self._ann_rows = 0
+            self._ann = index
+
+        if self._ann_rows < rows:
+            # Rows appended since the index was built or saved
+            if self._ann.get_max_elements() < rows:
+                self._ann.resize_index(rows)
+            matrix = self._read_matrix()
+            self._ann.add_items(matrix[self._ann_rows:rows], np.arange(self._ann_rows, rows))
+            self._ann_rows = rows
+        return self._ann